@@ -1,3 +1,92 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-# Register your models here.
+from .jobs import queue_job
+from .models import AccountJob, EmailAccount, SyncState
+from .settings import gmail_settings
+from .utils import estimate_count
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that doesn't run COUNT(*) over the whole table.
+
+    Filtered lists are estimated too, the built-in filters match most of the
+    table. Only small estimates are replaced by an exact count, a wrong
+    estimate there would show missing or empty pages.
+    """
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate < gmail_settings.ADMIN_EXACT_COUNT_BELOW:
+            return super(EstimatedCountPaginator, self).count
+        return estimate
+
+
+class EmailAccountAdmin(admin.ModelAdmin):
+    list_display = ('email_address', 'owner', 'is_authorized', 'sync_lag', 'error_count', 'last_error',
+                    'quota_used', 'is_deleted')
+    list_filter = ('is_authorized', 'is_deleted')
+    list_select_related = ('owner', 'sync_state')
+    search_fields = ('=email_address',)
+    ordering = ('-id',)
+    raw_id_fields = ('owner',)
+    readonly_fields = ('is_authorized',)
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    actions = ('resync', 'reauthorize', 'soft_delete')
+
+    def get_actions(self, request):
+        actions = super(EmailAccountAdmin, self).get_actions(request)
+        # Deletes every related row through the ORM, use soft delete and the purge instead.
+        actions.pop('delete_selected', None)
+        return actions
+
+    def _sync_state(self, obj):
+        try:
+            return obj.sync_state
+        except SyncState.DoesNotExist:
+            return None
+
+    def sync_lag(self, obj):
+        state = self._sync_state(obj)
+        if state is None or state.last_sync_finished is None:
+            return None
+        return timezone.now() - state.last_sync_finished
+    sync_lag.admin_order_field = 'sync_state__last_sync_finished'
+
+    def error_count(self, obj):
+        state = self._sync_state(obj)
+        return state.error_count if state else None
+    error_count.admin_order_field = 'sync_state__error_count'
+
+    def last_error(self, obj):
+        state = self._sync_state(obj)
+        return state.last_error[:100] if state else ''
+
+    def quota_used(self, obj):
+        state = self._sync_state(obj)
+        return state.quota_used if state else None
+
+    def _queue(self, request, queryset, action, description):
+        queue_job(action, queryset)
+        self.message_user(
+            request, 'Queued %s of the selected accounts, it runs with the next run_account_jobs command.' % (
+                description))
+
+    def resync(self, request, queryset):
+        self._queue(request, queryset, AccountJob.RESYNC, 'resync')
+    resync.short_description = 'Resync selected accounts'
+
+    def reauthorize(self, request, queryset):
+        self._queue(request, queryset, AccountJob.REAUTHORIZE, 'reauthorization')
+    reauthorize.short_description = 'Require reauthorization of selected accounts'
+
+    def soft_delete(self, request, queryset):
+        self._queue(request, queryset, AccountJob.SOFT_DELETE, 'deletion')
+    soft_delete.short_description = 'Soft delete selected accounts'
+
+
+admin.site.register(EmailAccount, EmailAccountAdmin)
@@ -0,0 +1,90 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import ChangeEvent, EmailAccount
+from .settings import gmail_settings
+from .signals import messages_changed
+
+
+def emit_changes(account, added=(), removed=(), relabeled=(), history_id=None):
+    """
+    Announce the changes of one applied sync chunk.
+
+    Sends a single ``messages_changed`` signal for the whole chunk and, when
+    ``CHANGE_OUTBOX`` is enabled, stores the chunk as a ``ChangeEvent`` so
+    consumers can read it later with ``changes_since`` instead of handling the
+    signal inside the sync transaction.
+
+    The signal is always sent synchronously, also with the outbox enabled:
+    receivers run inside the caller's (sync) transaction and slow it down, so
+    keep them cheap and read the outbox for anything heavier.
+
+    :param instance account: EmailAccount the changes belong to.
+    :param list added: Gmail ids of new messages.
+    :param list removed: Gmail ids of deleted messages.
+    :param list relabeled: Gmail ids of messages with changed labels.
+    :param int history_id: history id the account is synced to after this chunk.
+
+    :return: the stored ChangeEvent or ``None``.
+    """
+    added, removed, relabeled = list(added), list(removed), list(relabeled)
+    if not (added or removed or relabeled):
+        return None
+
+    event = None
+    if gmail_settings.CHANGE_OUTBOX:
+        event = ChangeEvent.objects.create(
+            account=account,
+            history_id=history_id,
+            added=ChangeEvent.join_ids(added),
+            removed=ChangeEvent.join_ids(removed),
+            relabeled=ChangeEvent.join_ids(relabeled),
+        )
+
+    messages_changed.send(
+        sender=EmailAccount,
+        account=account,
+        added=added,
+        removed=removed,
+        relabeled=relabeled,
+        history_id=history_id,
+    )
+    return event
+
+
+def changes_since(account, cursor=0, limit=100):
+    """
+    Read stored change events of an account after given cursor.
+
+    The id of the last returned event is the cursor for the next call.
+
+    :param instance account: EmailAccount to read events for.
+    :param int cursor: id of the last event already handled.
+    :param int limit: maximum number of events to return.
+
+    :return: list of ChangeEvent instances, oldest first.
+    """
+    return list(ChangeEvent.objects.filter(account=account, pk__gt=cursor).order_by('pk')[:limit])
+
+
+def prune_changes(retention=None, batch_size=1000):
+    """
+    Delete stored change events older than the retention period, in batches.
+
+    :param timedelta retention: how long events are kept, defaults to ``CHANGE_OUTBOX_RETENTION_DAYS``.
+    :param int batch_size: number of events deleted per query.
+
+    :return: number of deleted events.
+    """
+    if retention is None:
+        retention = timedelta(days=gmail_settings.CHANGE_OUTBOX_RETENTION_DAYS)
+    events = ChangeEvent.objects.filter(created__lt=timezone.now() - retention).order_by('pk')
+
+    total = 0
+    while True:
+        pks = list(events.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return total
+        ChangeEvent.objects.filter(pk__in=pks).delete()
+        total += len(pks)
@@ -0,0 +1,168 @@
+"""
+Store message bodies once for all EmailAccounts of an owner.
+
+Users often connect several accounts that receive the same messages. Before
+fetching the full message, ``sync_message`` looks for a message with the same
+RFC Message-ID and content key in another account of the same owner and reuses
+its body, so only the (cheap) metadata request is made for the copy.
+"""
+import hashlib
+import re
+
+from django.db import IntegrityError, router, transaction
+
+from .models import Message, MessageBody
+from .processing import decode_raw
+from .utils import MESSAGE_GET_UNITS
+
+HEADER_END_RE = re.compile(b'\r?\n\r?\n')
+
+
+def split_raw(raw):
+    """
+    Split a raw message in its header block and content.
+
+    Args:
+      raw (bytes): RFC 2822 message.
+
+    Returns:
+      tuple of header bytes and content bytes.
+    """
+    match = HEADER_END_RE.search(raw)
+    if match is None:
+        return raw, b''
+    return raw[:match.start()], raw[match.end():]
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def format_headers(headers):
+    """
+    Format the ``payload.headers`` list of a Gmail message resource as a header block.
+    """
+    return u''.join(u'%s: %s\r\n' % (header['name'], header['value']) for header in headers)
+
+
+def get_header(headers, name):
+    name = name.lower()
+    for header in headers:
+        if header['name'].lower() == name:
+            return header['value']
+    return u''
+
+
+def store_body(content):
+    """
+    Get or create the MessageBody for given content.
+
+    Args:
+      content (bytes): message content below the headers.
+
+    Returns:
+      MessageBody instance.
+    """
+    digest = content_hash(content)
+    # Read where the body is written, a lagging replica would miss a body just stored.
+    using = router.db_for_write(MessageBody)
+    bodies = MessageBody.objects.using(using)
+    try:
+        return bodies.get(content_hash=digest)
+    except MessageBody.DoesNotExist:
+        pass
+
+    try:
+        with transaction.atomic(using=using):
+            return bodies.create(content_hash=digest, content=content, size=len(content))
+    except IntegrityError:
+        # Stored by another worker in the meantime.
+        return bodies.get(content_hash=digest)
+
+
+def content_key(metadata, headers):
+    """
+    Fingerprint the content of a message from its ``format=metadata`` response.
+
+    The size below the headers can't be known exactly from metadata: Gmail
+    returns headers unfolded and ``sizeEstimate`` covers the raw message. The
+    key is only compared with keys computed the same way for other copies, so
+    it doesn't need to be exact, only deterministic. Gmail's snippet is part of
+    the key, so copies of equal length whose text differs near the top (eg.
+    a greeting with the recipient's name) don't match.
+
+    Returns:
+      hex digest.
+    """
+    body_size = int(metadata.get('sizeEstimate', 0)) - len(format_headers(headers).encode('utf-8'))
+    key = u'%s:%s' % (body_size, metadata.get('snippet', u''))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def find_shared_body(account, rfc_message_id, key):
+    """
+    Find a stored body of the same message in an account of the same owner.
+
+    Copies with the same Message-ID can still differ in content (eg. a footer
+    added by a mailing list), so the content key must match exactly. Copies
+    that differ only further down without changing the length can't be told
+    apart from metadata and do share a body.
+
+    Args:
+      account (instance): EmailAccount the message is synced for.
+      rfc_message_id (str): Message-ID header of the message, as stored.
+      key (str): see ``content_key``.
+
+    Returns:
+      MessageBody instance or None.
+    """
+    if not rfc_message_id:
+        return None
+    return MessageBody.objects.filter(
+        messages__account__owner_id=account.owner_id,
+        messages__rfc_message_id=rfc_message_id,
+        messages__content_key=key,
+    ).first()
+
+
+def sync_message(service, account, message_id):
+    """
+    Store a message of an account, fetching the full message only if needed.
+
+    Args:
+      service (instance): Gmail service object for the account.
+      account (instance): EmailAccount the message belongs to.
+      message_id (str): Gmail id of the message.
+
+    Returns:
+      Message instance.
+    """
+    metadata = service.users().messages().get(userId='me', id=message_id, format='metadata').execute()
+    units = MESSAGE_GET_UNITS
+    headers = metadata.get('payload', {}).get('headers', [])
+    rfc_message_id = get_header(headers, 'Message-ID')[:255]
+    key = content_key(metadata, headers)
+
+    # Gmail messages are immutable, a body stored for this very message is still valid.
+    body = MessageBody.objects.filter(messages__account=account, messages__message_id=message_id).first()
+    if body is None:
+        body = find_shared_body(account, rfc_message_id, key)
+    if body is None:
+        response = service.users().messages().get(userId='me', id=message_id, format='raw').execute()
+        units += MESSAGE_GET_UNITS
+        body = store_body(split_raw(decode_raw(response['raw']))[1])
+
+    account.add_quota_usage(units)
+
+    message, created = Message.objects.update_or_create(
+        account=account,
+        message_id=message_id,
+        defaults={
+            'thread_id': metadata.get('threadId', ''),
+            'rfc_message_id': rfc_message_id,
+            'content_key': key,
+            'headers': format_headers(headers),
+            'body': body,
+        },
+    )
+    return message
@@ -0,0 +1,275 @@
+"""
+Export the Gmail box of an EmailAccount to a mbox file or a zip of eml files.
+
+Messages are fetched with ``format=raw`` a few at a time and written straight
+to the archive, so memory use doesn't grow with the size of the mailbox. The
+``ExportState`` passed around tells where an interrupted export can resume.
+"""
+import logging
+import re
+import threading
+import time
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+from .processing import chunked, decode_raw
+from .settings import gmail_settings
+from .utils import MESSAGE_GET_UNITS, MESSAGE_LIST_UNITS, build_gmail_service
+
+MBOX = 'mbox'
+EML = 'eml'
+FORMATS = (MBOX, EML)
+
+CONTENT_TYPES = {
+    MBOX: 'application/mbox',
+    EML: 'application/zip',
+}
+
+EXTENSIONS = {
+    MBOX: 'mbox',
+    EML: 'zip',
+}
+
+FROM_LINE_RE = re.compile(br'^(>*From )', re.MULTILINE)
+
+logger = logging.getLogger(__name__)
+
+
+def message_time(message):
+    """
+    Get the time a message was received as a ``time.struct_time``.
+    """
+    return time.gmtime(int(message.get('internalDate', 0)) / 1000)
+
+
+class MboxWriter(object):
+    """
+    Write messages in mboxrd format.
+    """
+    def __init__(self, fileobj, append=False):
+        self.fileobj = fileobj
+
+    def write(self, message):
+        raw = FROM_LINE_RE.sub(br'>\1', message['raw'].replace(b'\r\n', b'\n'))
+        if not raw.endswith(b'\n'):
+            raw += b'\n'
+        from_line = 'From MAILER-DAEMON %s\n' % time.asctime(message_time(message))
+        self.fileobj.write(from_line.encode('ascii') + raw + b'\n')
+
+    def close(self):
+        self.fileobj.flush()
+
+
+class EmlZipWriter(object):
+    """
+    Write messages as eml files in a zip archive.
+    """
+    def __init__(self, fileobj, append=False):
+        self.zipfile = zipfile.ZipFile(fileobj, 'a' if append else 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def write(self, message):
+        info = zipfile.ZipInfo('%s.eml' % message['id'], date_time=message_time(message)[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        self.zipfile.writestr(info, message['raw'])
+
+    def close(self):
+        self.zipfile.close()
+
+
+WRITERS = {
+    MBOX: MboxWriter,
+    EML: EmlZipWriter,
+}
+
+
+class StreamBuffer(object):
+    """
+    Write only file object that keeps data until it's drained.
+
+    Lets the writers produce chunks for a streaming response; it can tell but
+    not seek, which zipfile handles by writing data descriptors.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ExportError(Exception):
+    pass
+
+
+class ExportState(object):
+    """
+    Position of an export: the page being exported and the messages written from it.
+    """
+    def __init__(self, page_token='', last_id='', count=0, size=0, done=False, page_ids=None):
+        self.page_token = page_token
+        self.last_id = last_id
+        self.count = count
+        self.size = size
+        self.done = done
+        self.page_ids = page_ids or []
+
+    def advance(self, position):
+        page_token, self.last_id = position
+        if page_token != self.page_token:
+            self.page_token, self.page_ids = page_token, []
+        self.page_ids.append(self.last_id)
+        self.count += 1
+
+    def to_dict(self):
+        return {
+            'page_token': self.page_token,
+            'last_id': self.last_id,
+            'page_ids': self.page_ids,
+            'count': self.count,
+            'size': self.size,
+            'done': self.done,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+def iter_messages(account, state, concurrency=None, page_size=None):
+    """
+    Fetch the raw messages of an account, starting at given state.
+
+    A resumed export lists the page it stopped in again and continues after
+    the last written message. Messages can be added or deleted in the
+    meantime, so it doesn't count on positions. When the last written message
+    was deleted, the whole page is exported again except the messages already
+    written from it; a message that moved onto the page from the previous one
+    can then be written twice, which beats starting over.
+
+    Args:
+      account (instance): EmailAccount to export.
+      state (instance): ExportState to start from, it isn't changed.
+      concurrency (int): number of messages fetched at the same time.
+      page_size (int): number of message ids listed per request.
+
+    Returns:
+      Generator of (message, position) tuples, where the message has the
+      decoded ``raw`` bytes and position is to be passed to
+      ``ExportState.advance`` once the message is written.
+    """
+    concurrency = concurrency or gmail_settings.EXPORT_CONCURRENCY
+    page_size = page_size or gmail_settings.EXPORT_PAGE_SIZE
+    credentials = account.get_credentials()
+    if credentials is None or credentials.invalid:
+        raise ExportError('EmailAccount %s has no valid credentials' % account.pk)
+    service = build_gmail_service(credentials)
+    local = threading.local()
+
+    def fetch(message_id):
+        # Service objects aren't thread safe, build one per thread.
+        if not hasattr(local, 'service'):
+            local.service = build_gmail_service(credentials)
+        message = local.service.users().messages().get(userId='me', id=message_id, format='raw').execute()
+        message['raw'] = decode_raw(message['raw'])
+        return message
+
+    page_token, last_id = state.page_token, state.last_id
+    # Ids of the previous page, new mail can push them onto the next page.
+    previous_ids = set()
+    pool = ThreadPool(concurrency)
+    try:
+        while True:
+            params = {'userId': 'me', 'maxResults': page_size, 'includeSpamTrash': True}
+            if page_token:
+                params['pageToken'] = page_token
+            account.add_quota_usage(MESSAGE_LIST_UNITS)
+            response = service.users().messages().list(**params).execute()
+            ids = [message['id'] for message in response.get('messages', [])]
+            next_page_token = response.get('nextPageToken', '')
+
+            todo = ids
+            if last_id:
+                if last_id in ids:
+                    todo = ids[ids.index(last_id) + 1:]
+                else:
+                    logger.warning('Message %s is no longer in the mailbox, resuming the export of '
+                                   'EmailAccount %s from the start of its page', last_id, account.pk)
+                    written = set(state.page_ids)
+                    todo = [pk for pk in ids if pk not in written]
+                last_id = ''
+
+            for window in chunked([pk for pk in todo if pk not in previous_ids], concurrency):
+                account.add_quota_usage(len(window) * MESSAGE_GET_UNITS)
+                for message in pool.map(fetch, window):
+                    yield message, (page_token, message['id'])
+
+            if not next_page_token:
+                break
+            page_token, previous_ids = next_page_token, set(ids)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def export_account(account, fileobj, format=MBOX, state=None, on_progress=None, concurrency=None):
+    """
+    Write all messages of an account to a file.
+
+    Args:
+      account (instance): EmailAccount to export.
+      fileobj (file): binary file to write to, opened for reading as well when resuming a zip.
+      format (str): ``MBOX`` or ``EML``.
+      state (instance): ExportState to resume from, updated as messages are written.
+      on_progress (callable): called with the state after every written message.
+      concurrency (int): number of messages fetched at the same time.
+
+    Returns:
+      The ExportState.
+    """
+    state = state or ExportState()
+    writer = WRITERS[format](fileobj, append=state.count > 0)
+    try:
+        for message, position in iter_messages(account, state, concurrency=concurrency):
+            writer.write(message)
+            state.advance(position)
+            if on_progress is not None:
+                on_progress(state)
+    finally:
+        writer.close()
+    state.done = True
+    return state
+
+
+def stream_account(account, format=MBOX, concurrency=None):
+    """
+    Export an account as a stream of bytes, eg. for a ``StreamingHttpResponse``.
+
+    Args:
+      account (instance): EmailAccount to export.
+      format (str): ``MBOX`` or ``EML``.
+      concurrency (int): number of messages fetched at the same time.
+
+    Returns:
+      Generator of bytes.
+    """
+    buffer = StreamBuffer()
+    writer = WRITERS[format](buffer)
+    for message, position in iter_messages(account, ExportState(), concurrency=concurrency):
+        writer.write(message)
+        data = buffer.drain()
+        if data:
+            yield data
+    writer.close()
+    yield buffer.drain()
@@ -0,0 +1,141 @@
+"""
+Bulk operations on EmailAccounts, queued by the admin actions.
+
+The admin actions store an ``AccountJob`` instead of updating thousands of
+rows inside the request; the ``run_account_jobs`` management command (eg.
+run from cron) picks them up. Updates are done in chunks, each a single
+``UPDATE`` statement, so running a job again is harmless.
+"""
+import logging
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import AccountJob, EmailAccount, SyncState
+from .settings import gmail_settings
+from .utils import chunked
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+
+
+def resync_accounts(account_ids):
+    """
+    Reset the sync state of accounts, so the next sync starts from scratch.
+    """
+    for chunk in chunked(account_ids, CHUNK_SIZE):
+        SyncState.objects.filter(pk__in=chunk).update(
+            history_id=None,
+            temp_history_id=None,
+            page_token='',
+            error_count=0,
+            last_error='',
+        )
+
+
+def reauthorize_accounts(account_ids):
+    """
+    Flag accounts as unauthorized, so their owners have to go through the OAuth2 setup again.
+    """
+    for chunk in chunked(account_ids, CHUNK_SIZE):
+        EmailAccount.objects.filter(pk__in=chunk).update(is_authorized=False, modified=timezone.now())
+
+
+def soft_delete_accounts(account_ids):
+    """
+    Soft delete accounts, like ``DeletedMixin.delete`` does for a single instance.
+    """
+    for chunk in chunked(account_ids, CHUNK_SIZE):
+        now = timezone.now()
+        EmailAccount.objects.filter(pk__in=chunk).update(is_deleted=True, deleted=now, modified=now)
+
+
+JOBS = {
+    AccountJob.RESYNC: resync_accounts,
+    AccountJob.REAUTHORIZE: reauthorize_accounts,
+    AccountJob.SOFT_DELETE: soft_delete_accounts,
+}
+
+
+def queue_job(action, queryset):
+    """
+    Store a job to run on the accounts of a queryset, they're only resolved when it runs.
+
+    Arguments:
+        action (str): one of ``AccountJob.ACTIONS``
+        queryset (instance): QuerySet of EmailAccounts
+
+    Returns:
+        AccountJob instance.
+    """
+    job = AccountJob(action=action)
+    job.set_queryset(queryset)
+    job.save()
+    return job
+
+
+def iter_account_ids(queryset):
+    """
+    Yield the ids of a queryset in chunks of ``CHUNK_SIZE``, paginating on the id.
+    """
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:CHUNK_SIZE])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def claim_job(job, timeout):
+    """
+    Mark a job as started, unless another runner started it less than timeout ago.
+
+    Returns:
+        True if the job was claimed.
+    """
+    now = timezone.now()
+    return bool(AccountJob.objects.filter(pk=job.pk, finished__isnull=True).filter(
+        Q(started__isnull=True) | Q(started__lt=now - timeout)
+    ).update(started=now))
+
+
+def run_job(job):
+    """
+    Run a claimed job and store its outcome, a failed job isn't retried.
+    """
+    error = ''
+    try:
+        for account_ids in iter_account_ids(job.get_queryset()):
+            JOBS[job.action](account_ids)
+    except Exception as e:
+        logger.exception('AccountJob %s failed', job.pk)
+        error = u'%s' % e
+    AccountJob.objects.filter(pk=job.pk).update(finished=timezone.now(), error=error)
+
+
+def run_pending_jobs(limit=None):
+    """
+    Run the jobs that haven't finished, oldest first.
+
+    Jobs whose runner died are run again once ``JOB_TIMEOUT_SECONDS`` passed.
+
+    Arguments:
+        limit (int): maximum number of jobs to run
+
+    Returns:
+        number of jobs run.
+    """
+    timeout = timedelta(seconds=gmail_settings.JOB_TIMEOUT_SECONDS)
+    jobs = AccountJob.objects.filter(finished__isnull=True).order_by('pk')
+    if limit:
+        jobs = jobs[:limit]
+
+    count = 0
+    for job in list(jobs):
+        if claim_job(job, timeout):
+            run_job(job)
+            count += 1
+    return count
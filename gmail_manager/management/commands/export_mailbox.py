@@ -0,0 +1,67 @@
+import json
+import os
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gmail_manager.export import FORMATS, MBOX, ExportError, ExportState, export_account
+from gmail_manager.models import EmailAccount
+
+# Write the resume state every this many messages.
+SAVE_EVERY = 50
+
+
+class Command(BaseCommand):
+    help = 'Export the Gmail box of an EmailAccount to a mbox file or a zip of eml files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('account_id', type=int)
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, default=MBOX)
+        parser.add_argument('--resume', action='store_true', default=False,
+                            help='Continue an interrupted export to the same path.')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Number of messages fetched at the same time.')
+
+    def handle(self, *args, **options):
+        try:
+            account = EmailAccount.objects.get(pk=options['account_id'], is_deleted=False)
+        except EmailAccount.DoesNotExist:
+            raise CommandError('EmailAccount %s does not exist' % options['account_id'])
+
+        path = options['path']
+        state_path = '%s.state' % path
+        resume = options['resume'] and os.path.exists(path) and os.path.exists(state_path)
+
+        state = ExportState()
+        if resume:
+            with open(state_path) as state_file:
+                state = ExportState.from_dict(json.load(state_file))
+
+        def save_state(state):
+            fileobj.flush()
+            with open(state_path, 'w') as state_file:
+                json.dump(state.to_dict(), state_file)
+
+        def on_progress(state):
+            state.size = fileobj.tell()
+            if state.count % SAVE_EVERY == 0:
+                save_state(state)
+
+        with open(path, 'r+b' if resume else 'wb') as fileobj:
+            if resume and options['format'] == MBOX:
+                # Drop a message that was only partly written when the export stopped.
+                fileobj.seek(state.size)
+                fileobj.truncate()
+
+            try:
+                export_account(account, fileobj, options['format'], state, on_progress, options['concurrency'])
+            except ExportError as e:
+                raise CommandError(str(e))
+            except zipfile.BadZipfile:
+                raise CommandError('%s is not a complete zip file and can not be resumed.' % path)
+            finally:
+                save_state(state)
+
+        os.remove(state_path)
+        self.stdout.write('Exported %s messages to %s.' % (state.count, path))
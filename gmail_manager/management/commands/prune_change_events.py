@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from gmail_manager.changes import prune_changes
+
+
+class Command(BaseCommand):
+    help = 'Delete ChangeEvents older than the retention period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Retention period in days, defaults to CHANGE_OUTBOX_RETENTION_DAYS.')
+
+    def handle(self, *args, **options):
+        retention = timedelta(days=options['days']) if options['days'] is not None else None
+        count = prune_changes(retention=retention)
+        self.stdout.write('Deleted %s change events.' % count)
@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from gmail_manager.purge import purge_deleted_accounts
+
+
+class Command(BaseCommand):
+    help = 'Permanently remove EmailAccounts that were soft deleted longer than the retention period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Retention period in days, defaults to PURGE_RETENTION_DAYS.')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Maximum number of accounts to purge.')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Number of rows deleted per transaction.')
+        parser.add_argument('--pause', type=float, default=None,
+                            help='Seconds to wait between batches.')
+        parser.add_argument('--no-revoke', action='store_false', dest='revoke', default=True,
+                            help='Do not revoke the OAuth2 tokens at Google.')
+
+    def handle(self, *args, **options):
+        retention = timedelta(days=options['days']) if options['days'] is not None else None
+        count = purge_deleted_accounts(
+            retention=retention,
+            limit=options['limit'],
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            revoke=options['revoke'],
+        )
+        self.stdout.write('Purged %s accounts.' % count)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from gmail_manager.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = 'Run the bulk operations on EmailAccounts queued by the admin actions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Maximum number of jobs to run.')
+
+    def handle(self, *args, **options):
+        count = run_pending_jobs(limit=options['limit'])
+        self.stdout.write('Ran %s jobs.' % count)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def copy_sync_state(apps, schema_editor):
+    EmailAccount = apps.get_model('gmail_manager', 'EmailAccount')
+    SyncState = apps.get_model('gmail_manager', 'SyncState')
+    db_alias = schema_editor.connection.alias
+
+    accounts = EmailAccount.objects.using(db_alias).values_list('id', 'history_id', 'temp_history_id')
+    SyncState.objects.using(db_alias).bulk_create([
+        SyncState(account_id=pk, history_id=history_id, temp_history_id=temp_history_id)
+        for pk, history_id, temp_history_id in accounts.iterator()
+    ], batch_size=1000)
+
+
+def restore_sync_state(apps, schema_editor):
+    EmailAccount = apps.get_model('gmail_manager', 'EmailAccount')
+    SyncState = apps.get_model('gmail_manager', 'SyncState')
+    db_alias = schema_editor.connection.alias
+
+    states = SyncState.objects.using(db_alias).values_list('account_id', 'history_id', 'temp_history_id')
+    for pk, history_id, temp_history_id in states.iterator():
+        EmailAccount.objects.using(db_alias).filter(pk=pk).update(
+            history_id=history_id,
+            temp_history_id=temp_history_id,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gmail_manager', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('account', models.OneToOneField(related_name='sync_state', primary_key=True, serialize=False, to='gmail_manager.EmailAccount')),
+                ('history_id', models.BigIntegerField(null=True)),
+                ('temp_history_id', models.BigIntegerField(null=True)),
+                ('page_token', models.CharField(default=b'', max_length=255, blank=True)),
+                ('last_sync_started', models.DateTimeField(null=True)),
+                ('last_sync_finished', models.DateTimeField(null=True)),
+                ('error_count', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(default=b'', blank=True)),
+                ('lease_holder', models.CharField(default=b'', max_length=255, blank=True)),
+                ('lease_expires', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.RunPython(copy_sync_state, restore_sync_state),
+        migrations.RemoveField(
+            model_name='emailaccount',
+            name='history_id',
+        ),
+        migrations.RemoveField(
+            model_name='emailaccount',
+            name='temp_history_id',
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gmail_manager', '0002_syncstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('history_id', models.BigIntegerField(null=True)),
+                ('added', models.TextField(default=b'', blank=True)),
+                ('removed', models.TextField(default=b'', blank=True)),
+                ('relabeled', models.TextField(default=b'', blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(related_name='change_events', to='gmail_manager.EmailAccount')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='changeevent',
+            index_together=set([('account', 'id')]),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gmail_manager', '0003_changeevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageBody',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('content_hash', models.CharField(unique=True, max_length=64)),
+                ('content', models.BinaryField()),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('message_id', models.CharField(max_length=50)),
+                ('thread_id', models.CharField(default=b'', max_length=50)),
+                ('rfc_message_id', models.CharField(default=b'', max_length=255, db_index=True)),
+                ('headers', models.TextField(default=b'')),
+                ('account', models.ForeignKey(related_name='messages', to='gmail_manager.EmailAccount')),
+                ('body', models.ForeignKey(related_name='messages', on_delete=django.db.models.deletion.SET_NULL, to='gmail_manager.MessageBody', null=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='message',
+            unique_together=set([('account', 'message_id')]),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gmail_manager', '0004_message_messagebody'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emailaccount',
+            name='email_address',
+            field=models.EmailField(max_length=254, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='syncstate',
+            name='quota_used',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='syncstate',
+            name='quota_window_start',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='syncstate',
+            name='error_count',
+            field=models.PositiveIntegerField(default=0, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='syncstate',
+            name='last_sync_finished',
+            field=models.DateTimeField(null=True, db_index=True),
+        ),
+    ]
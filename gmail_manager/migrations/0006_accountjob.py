@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gmail_manager', '0005_syncstate_health'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('action', models.CharField(max_length=32, choices=[(b'resync', 'Resync'), (b'reauthorize', 'Reauthorize'), (b'soft_delete', 'Soft delete')])),
+                ('account_ids', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True)),
+                ('finished', models.DateTimeField(null=True, db_index=True)),
+                ('error', models.TextField(default=b'', blank=True)),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gmail_manager', '0007_changeevent_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='content_key',
+            field=models.CharField(default=b'', max_length=64, blank=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gmail_manager', '0008_message_content_key'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='accountjob',
+            name='account_ids',
+        ),
+        migrations.AddField(
+            model_name='accountjob',
+            name='query',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+    ]
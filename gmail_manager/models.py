@@ -1,5 +1,10 @@
+from datetime import timedelta
+
 from django.conf import settings
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+from django.utils.six.moves import cPickle as pickle
 from django.utils.translation import ugettext_lazy as _
 from django_extensions.db.fields import ModificationDateTimeField
 from django_extensions.db.models import TimeStampedModel
@@ -39,15 +44,11 @@ class EmailAccount(DeletedMixin, models.Model):
     """
     Email Account linked to a user
     """
-    email_address = models.EmailField(max_length=254)
+    email_address = models.EmailField(max_length=254, db_index=True)
     from_name = models.CharField(max_length=254, default='')
     label = models.CharField(max_length=254, default='')
     is_authorized = models.BooleanField(default=False)
 
-    # History id is a field to keep track of the sync status of a gmail box
-    history_id = models.BigIntegerField(null=True)
-    temp_history_id = models.BigIntegerField(null=True)
-
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='email_accounts_owned')
 
     @classmethod
@@ -56,23 +57,42 @@ class EmailAccount(DeletedMixin, models.Model):
         service = build_gmail_service(credentials)
         response = service.users().getProfile(userId='me').execute()
 
-        # Create account based on email address
-        account = cls.objects.get_or_create(
-            owner=user,
-            email_address=response.get('emailAddress'),
-            label=response.get('emailAddress'),
-        )[0]
-
-        # Store credentials based on new email account
-        storage = Storage(GmailCredentialsModel, 'id', account, 'credentials')
-        storage.put(credentials)
-
-        # Set account as authorized
-        account.is_authorized = True
-        account.is_deleted = False
-        account.save()
+        with transaction.atomic(using=router.db_for_write(cls)):
+            # Create account based on email address, locked so a running purge
+            # (see ``purge.Purger``) waits and then sees it's no longer deleted.
+            account = cls.objects.select_for_update().get_or_create(
+                owner=user,
+                email_address=response.get('emailAddress'),
+                label=response.get('emailAddress'),
+            )[0]
+
+            # Set account as authorized, before the new credentials are stored
+            account.is_authorized = True
+            account.is_deleted = False
+            account.save()
+
+            # Store credentials based on new email account
+            storage = Storage(GmailCredentialsModel, 'id', account, 'credentials')
+            storage.put(credentials)
+
+            SyncState.objects.get_or_create(account=account)
         return account
 
+    def add_quota_usage(self, units):
+        """
+        Count Gmail quota units used for this account, see ``SyncState.add_quota_usage``.
+        """
+        SyncState(account_id=self.pk).add_quota_usage(units)
+
+    def get_credentials(self):
+        """
+        Get the stored OAuth2 credentials of this account.
+
+        Returns:
+            Credentials instance or None.
+        """
+        return Storage(GmailCredentialsModel, 'id', self, 'credentials').get()
+
     def __unicode__(self):
         return u'%s  (%s)' % (self.label, self.email_address)
 
@@ -83,3 +103,277 @@ class GmailCredentialsModel(models.Model):
     """
     id = models.OneToOneField(EmailAccount, primary_key=True)
     credentials = CredentialsField()
+
+
+class SyncState(models.Model):
+    """
+    Sync progress of an EmailAccount.
+
+    Kept apart from EmailAccount so frequent checkpoints are narrow updates
+    that don't rewrite the account row, bump its ``modified`` timestamp or
+    contend with user edits for the row lock. All mutating methods issue a
+    single ``UPDATE`` on this table and leave in-memory instances alone; the
+    row is created first when it's missing.
+    """
+    account = models.OneToOneField(EmailAccount, primary_key=True, related_name='sync_state')
+
+    # History id is a field to keep track of the sync status of a gmail box
+    history_id = models.BigIntegerField(null=True)
+    temp_history_id = models.BigIntegerField(null=True)
+    page_token = models.CharField(max_length=255, default='', blank=True)
+
+    last_sync_started = models.DateTimeField(null=True)
+    last_sync_finished = models.DateTimeField(null=True, db_index=True)
+
+    error_count = models.PositiveIntegerField(default=0, db_index=True)
+    last_error = models.TextField(default='', blank=True)
+
+    lease_holder = models.CharField(max_length=255, default='', blank=True)
+    lease_expires = models.DateTimeField(null=True)
+
+    # Gmail quota units used by the sync since ``quota_window_start``
+    quota_used = models.PositiveIntegerField(default=0)
+    quota_window_start = models.DateTimeField(null=True)
+
+    def _update(self, *conditions, **kwargs):
+        queryset = SyncState.objects.filter(*conditions, pk=self.pk)
+        updated = queryset.update(**kwargs)
+        if not updated:
+            # Accounts not created by ``create_account_from_credentials`` (admin,
+            # fixtures) may not have a row yet.
+            created = SyncState.objects.get_or_create(account_id=self.pk)[1]
+            if created:
+                updated = queryset.update(**kwargs)
+        return updated
+
+    def checkpoint(self, history_id=None, page_token=None):
+        """
+        Store the sync cursor.
+
+        Arguments:
+            history_id (int): temporary history id reached so far
+            page_token (str): token of the next page to fetch, if any
+        """
+        fields = {}
+        if history_id is not None:
+            fields['temp_history_id'] = history_id
+        if page_token is not None:
+            fields['page_token'] = page_token
+        if fields:
+            self._update(**fields)
+
+    def start(self):
+        """
+        Mark the start of a sync run.
+        """
+        self._update(last_sync_started=timezone.now())
+
+    def finish(self, history_id):
+        """
+        Mark a sync run as completed up to given history id.
+
+        Arguments:
+            history_id (int): history id the mailbox is synced to
+        """
+        self._update(
+            history_id=history_id,
+            temp_history_id=None,
+            page_token='',
+            last_sync_finished=timezone.now(),
+            error_count=0,
+            last_error='',
+        )
+
+    def fail(self, error):
+        """
+        Register a failed sync run.
+
+        Arguments:
+            error (str|Exception): reason of the failure
+        """
+        self._update(error_count=F('error_count') + 1, last_error=u'%s' % error)
+
+    def add_quota_usage(self, units):
+        """
+        Count Gmail quota units used for the account (sync, prefetch, export), per day.
+
+        A single ``UPDATE`` adds the units, or starts a new window when the
+        current one is over, so concurrent callers don't lose units.
+
+        Arguments:
+            units (int): quota units of the requests made
+        """
+        now = timezone.now()
+        in_window = Q(quota_window_start__gte=now - timedelta(days=1))
+        self._update(
+            quota_used=Case(
+                When(in_window, then=F('quota_used') + units),
+                default=Value(units),
+                output_field=models.PositiveIntegerField(),
+            ),
+            quota_window_start=Case(
+                When(in_window, then=F('quota_window_start')),
+                default=Value(now),
+                output_field=models.DateTimeField(),
+            ),
+        )
+
+    def acquire_lease(self, holder, duration=timedelta(minutes=5)):
+        """
+        Claim the account for given worker, unless another worker holds a valid lease.
+
+        Arguments:
+            holder (str): unique name of the worker
+            duration (timedelta): how long the lease is valid
+
+        Returns:
+            True if the lease was acquired.
+        """
+        now = timezone.now()
+        return bool(self._update(
+            Q(lease_holder='') | Q(lease_holder=holder) | Q(lease_expires__lt=now),
+            lease_holder=holder,
+            lease_expires=now + duration,
+        ))
+
+    def release_lease(self, holder):
+        """
+        Give up the lease if given worker still holds it.
+
+        Arguments:
+            holder (str): unique name of the worker
+        """
+        SyncState.objects.filter(pk=self.pk, lease_holder=holder).update(lease_holder='', lease_expires=None)
+
+    def __unicode__(self):
+        return u'%s' % self.account_id
+
+
+class ChangeEvent(models.Model):
+    """
+    Outbox of applied sync chunks, so consumers can catch up from a cursor.
+
+    Message ids are stored comma separated to keep the rows compact.
+    """
+    account = models.ForeignKey(EmailAccount, related_name='change_events')
+    history_id = models.BigIntegerField(null=True)
+    added = models.TextField(default='', blank=True)
+    removed = models.TextField(default='', blank=True)
+    relabeled = models.TextField(default='', blank=True)
+    # Indexed for ``changes.prune_changes``
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    @staticmethod
+    def join_ids(ids):
+        return ','.join(ids)
+
+    @staticmethod
+    def split_ids(value):
+        return value.split(',') if value else []
+
+    @property
+    def added_ids(self):
+        return self.split_ids(self.added)
+
+    @property
+    def removed_ids(self):
+        return self.split_ids(self.removed)
+
+    @property
+    def relabeled_ids(self):
+        return self.split_ids(self.relabeled)
+
+    class Meta:
+        ordering = ('id',)
+        index_together = (('account', 'id'),)
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.account_id, self.history_id)
+
+
+class AccountJob(models.Model):
+    """
+    Bulk operation on EmailAccounts, queued by an admin action.
+
+    Jobs are stored rather than run in the web process, so they survive
+    restarts; the ``run_account_jobs`` management command runs them. The
+    job keeps the (pickled) query of the selected accounts instead of their
+    ids, so selecting all accounts doesn't load them in the request.
+    """
+    RESYNC = 'resync'
+    REAUTHORIZE = 'reauthorize'
+    SOFT_DELETE = 'soft_delete'
+    ACTIONS = (
+        (RESYNC, _('Resync')),
+        (REAUTHORIZE, _('Reauthorize')),
+        (SOFT_DELETE, _('Soft delete')),
+    )
+
+    action = models.CharField(max_length=32, choices=ACTIONS)
+    # Pickled ``Query`` of the EmailAccounts to run on
+    query = models.BinaryField()
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True, db_index=True)
+    error = models.TextField(default='', blank=True)
+
+    def set_queryset(self, queryset):
+        self.query = pickle.dumps(queryset.select_related(None).order_by().query, pickle.HIGHEST_PROTOCOL)
+
+    def get_queryset(self):
+        queryset = EmailAccount.objects.all()
+        queryset.query = pickle.loads(bytes(self.query))
+        return queryset
+
+    class Meta:
+        ordering = ('id',)
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.action, self.pk)
+
+
+class MessageBody(models.Model):
+    """
+    Content of a message below its headers, stored once per content hash.
+
+    Headers differ per mailbox (Delivered-To, Received), so they are kept on
+    the Message rows that reference a body.
+    """
+    content_hash = models.CharField(max_length=64, unique=True)
+    content = models.BinaryField()
+    size = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return self.content_hash
+
+
+class Message(models.Model):
+    """
+    Message in the Gmail box of an EmailAccount
+    """
+    account = models.ForeignKey(EmailAccount, related_name='messages')
+    message_id = models.CharField(max_length=50)
+    thread_id = models.CharField(max_length=50, default='')
+    rfc_message_id = models.CharField(max_length=255, default='', db_index=True)
+    # Fingerprint of the content from the metadata, see ``dedup.content_key``
+    content_key = models.CharField(max_length=64, default='', blank=True)
+    headers = models.TextField(default='')
+    body = models.ForeignKey(MessageBody, related_name='messages', null=True, on_delete=models.SET_NULL)
+
+    def get_raw(self):
+        """
+        Rebuild the full RFC 2822 message from the headers and shared body.
+
+        Returns:
+            bytes of the message or None if the body isn't stored.
+        """
+        if self.body_id is None:
+            return None
+        return self.headers.encode('utf-8') + b'\r\n' + bytes(self.body.content)
+
+    class Meta:
+        unique_together = (('account', 'message_id'),)
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.message_id, self.account_id)
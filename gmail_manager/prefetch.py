@@ -0,0 +1,323 @@
+"""
+Read-ahead of message threads.
+
+After the inbox of an EmailAccount is listed, the user will most likely open
+one of the top threads next. ``Prefetcher.schedule`` fetches those threads in
+the background, in one batch request, into a bounded cache with a time to
+live, so ``Prefetcher.get_thread`` usually doesn't need a Gmail round-trip.
+A cached thread is only used while its ``historyId`` matches the listing, so
+a thread that got a new reply is fetched again.
+
+Prefetching spends at most ``PREFETCH_QUOTA_UNITS`` quota units per account
+every ``PREFETCH_QUOTA_WINDOW`` seconds, and a new listing of an account
+cancels its prefetches that haven't started yet.
+
+The cache, quota budget and statistics live in the memory of one process.
+With several WSGI worker processes a thread prefetched by one worker is a
+miss in the others, so it works best when requests of a user end up in the
+same process (eg. sticky sessions or a threaded worker).
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from django.db import connection
+
+from .settings import gmail_settings
+from .utils import THREAD_GET_UNITS, THREAD_LIST_UNITS, build_gmail_service
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache(object):
+    """
+    Thread safe LRU cache of at most ``max_size`` items that expire after ``ttl`` seconds.
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                expires, value = self.items.pop(key)
+            except KeyError:
+                return None
+            if expires < time.time():
+                return None
+            # Re-insert to mark as most recently used.
+            self.items[key] = (expires, value)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = (time.time() + self.ttl, value)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def __contains__(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            return item is not None and item[0] >= time.time()
+
+    def __len__(self):
+        return len(self.items)
+
+
+def set_bounded(items, key, value, max_size):
+    """
+    Set key of an OrderedDict as most recent, dropping the oldest keys beyond max_size.
+    """
+    items.pop(key, None)
+    items[key] = value
+    while len(items) > max_size:
+        items.popitem(last=False)
+
+
+class QuotaBudget(object):
+    """
+    Fixed window budget of quota units per account, for at most ``max_keys`` accounts.
+    """
+    def __init__(self, units, window, max_keys=1000):
+        self.units = units
+        self.window = window
+        self.max_keys = max_keys
+        self.spent = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, units, wanted=1):
+        """
+        Take budget for up to ``wanted`` requests of ``units`` each.
+
+        Returns:
+          number of requests that fit in the remaining budget.
+        """
+        with self.lock:
+            now = time.time()
+            start, spent = self.spent.get(key, (now, 0))
+            if now - start >= self.window:
+                start, spent = now, 0
+            allowed = max(min(wanted, (self.units - spent) // units), 0)
+            # Dropping an account only forgets its spending in the current window.
+            set_bounded(self.spent, key, (start, spent + allowed * units), self.max_keys)
+            return allowed
+
+
+class Prefetcher(object):
+    """
+    Fetch the top threads of an inbox in the background.
+    """
+    def __init__(self, top_n=None, cache_size=None, ttl=None, quota_units=None, quota_window=None, workers=None):
+        self.top_n = top_n or gmail_settings.PREFETCH_TOP_N
+        self.max_accounts = cache_size or gmail_settings.PREFETCH_CACHE_SIZE
+        self.cache = TTLCache(self.max_accounts, ttl or gmail_settings.PREFETCH_TTL)
+        self.budget = QuotaBudget(
+            quota_units or gmail_settings.PREFETCH_QUOTA_UNITS,
+            quota_window or gmail_settings.PREFETCH_QUOTA_WINDOW,
+            max_keys=self.max_accounts,
+        )
+        self.workers = workers or gmail_settings.PREFETCH_WORKERS
+        # Generations are unique over all accounts, so a dropped account can't
+        # get the generation of one of its pending prefetches back.
+        self.generations = OrderedDict()
+        self.next_generation = itertools.count(1)
+        self.counters = dict.fromkeys(('hits', 'misses', 'prefetched', 'cancelled', 'throttled', 'failed'), 0)
+        self.lock = threading.Lock()
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPool(self.workers)
+        return self._pool
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def cancel(self, account):
+        """
+        Cancel pending prefetches of an account.
+
+        Returns:
+          the new generation of the account.
+        """
+        with self.lock:
+            generation = next(self.next_generation)
+            set_bounded(self.generations, account.pk, generation, self.max_accounts)
+            return generation
+
+    def is_current(self, account, generation):
+        with self.lock:
+            return self.generations.get(account.pk) == generation
+
+    def cached_thread(self, account, thread_id, history_id=None):
+        """
+        Get a thread from the cache, unless it changed since it was cached.
+
+        Arguments:
+            account (instance): EmailAccount the thread belongs to
+            thread_id (str): Gmail thread id
+            history_id (str): ``historyId`` of the thread in the latest listing, if known
+
+        Returns:
+            thread resource or None.
+        """
+        thread = self.cache.get((account.pk, thread_id))
+        if thread is None or (history_id is not None and str(thread.get('historyId')) != str(history_id)):
+            return None
+        return thread
+
+    def schedule(self, account, threads):
+        """
+        Queue a prefetch of the first threads of a listing.
+
+        Arguments:
+            account (instance): EmailAccount the listing belongs to
+            threads (list): thread resources of the listing (``id`` and ``historyId``) in the order they are shown
+        """
+        generation = self.cancel(account)
+        wanted = [thread['id'] for thread in threads[:self.top_n]
+                  if self.cached_thread(account, thread['id'], thread.get('historyId')) is None]
+        if wanted:
+            self.submit(self.prefetch, account, generation, wanted)
+
+    def submit(self, func, *args):
+        self.pool.apply_async(func, args)
+
+    def prefetch(self, account, generation, thread_ids):
+        """
+        Fetch threads into the cache, unless the prefetch was cancelled.
+
+        Runs in a pool thread, so errors are logged and counted instead of raised.
+        """
+        try:
+            self._prefetch(account, generation, thread_ids)
+        except Exception:
+            self.count('failed')
+            logger.exception('Prefetch of threads of EmailAccount %s failed', account.pk)
+        finally:
+            # Connections are per thread, don't leave this one open.
+            connection.close()
+
+    def _prefetch(self, account, generation, thread_ids):
+        if not self.is_current(account, generation):
+            self.count('cancelled')
+            return
+
+        allowed = self.budget.take(account.pk, THREAD_GET_UNITS, len(thread_ids))
+        if allowed < len(thread_ids):
+            self.count('throttled', len(thread_ids) - allowed)
+        if not allowed:
+            return
+
+        # Failed requests of the batch use quota too.
+        account.add_quota_usage(allowed * THREAD_GET_UNITS)
+        for thread_id, thread in self.fetch_threads(account, thread_ids[:allowed]).items():
+            self.cache.set((account.pk, thread_id), thread)
+            self.count('prefetched')
+
+    def fetch_threads(self, account, thread_ids):
+        """
+        Fetch threads in one batch request.
+
+        Returns:
+            dict of thread id to thread resource, failed threads are left out.
+        """
+        from googleapiclient.http import BatchHttpRequest
+
+        service = build_gmail_service(account.get_credentials())
+        threads = {}
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                threads[request_id] = response
+
+        batch = BatchHttpRequest(callback=callback)
+        for thread_id in thread_ids:
+            batch.add(service.users().threads().get(userId='me', id=thread_id), request_id=thread_id)
+        batch.execute()
+        return threads
+
+    def get_thread(self, account, thread_id, service=None, history_id=None):
+        """
+        Get a thread from the cache, or from Gmail if it wasn't prefetched or changed since.
+
+        Arguments:
+            account (instance): EmailAccount the thread belongs to
+            thread_id (str): Gmail thread id
+            service (instance): Gmail service object to use on a miss
+            history_id (str): ``historyId`` of the thread in the listing it was opened from
+
+        Returns:
+            thread resource.
+        """
+        thread = self.cached_thread(account, thread_id, history_id)
+        if thread is not None:
+            self.count('hits')
+            return thread
+
+        self.count('misses')
+        service = service or build_gmail_service(account.get_credentials())
+        account.add_quota_usage(THREAD_GET_UNITS)
+        thread = service.users().threads().get(userId='me', id=thread_id).execute()
+        self.cache.set((account.pk, thread_id), thread)
+        return thread
+
+    def stats(self):
+        """
+        Get the counters of the prefetcher and the hit rate of ``get_thread``.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0.0
+        stats['cached'] = len(self.cache)
+        return stats
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+_prefetcher = None
+
+
+def get_prefetcher():
+    """
+    Get the process wide Prefetcher, it's constructed on first use.
+    """
+    global _prefetcher
+    if _prefetcher is None:
+        _prefetcher = Prefetcher()
+    return _prefetcher
+
+
+def list_inbox(service, account, max_results=50, page_token=None):
+    """
+    List the inbox threads of an account and prefetch the top ones.
+
+    Args:
+      service (instance): Gmail service object for the account.
+      account (instance): EmailAccount to list.
+      max_results (int): number of threads to list.
+      page_token (str): token of the page to list.
+
+    Returns:
+      threads.list response.
+    """
+    params = {'userId': 'me', 'labelIds': ['INBOX'], 'maxResults': max_results}
+    if page_token:
+        params['pageToken'] = page_token
+    account.add_quota_usage(THREAD_LIST_UNITS)
+    response = service.users().threads().list(**params).execute()
+    get_prefetcher().schedule(account, response.get('threads', []))
+    return response
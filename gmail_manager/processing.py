@@ -0,0 +1,265 @@
+"""
+CPU bound processing of raw Gmail messages.
+
+Parsing MIME, decoding charsets and converting html to text hold the GIL, so
+doing it in the threads that talk to Gmail starves them. ``MessageProcessor``
+moves that work to a pool of worker processes, while small batches are still
+handled in the calling process to avoid the pickling round-trip.
+"""
+import base64
+import collections
+import email
+import multiprocessing
+import re
+from email.header import decode_header
+
+from django.utils import six
+from django.utils.six.moves import html_parser
+from django.utils.six.moves.html_entities import name2codepoint
+
+from .settings import gmail_settings
+from .utils import chunked
+
+SNIPPET_LENGTH = 200
+
+WHITESPACE_RE = re.compile(r'\s+', re.UNICODE)
+
+message_from_bytes = getattr(email, 'message_from_bytes', email.message_from_string)
+
+
+class HTMLTextExtractor(html_parser.HTMLParser):
+    """
+    Collects the visible text of a html document.
+    """
+    skip_tags = ('script', 'style', 'head', 'title')
+    block_tags = ('br', 'p', 'div', 'tr', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote')
+
+    def __init__(self):
+        html_parser.HTMLParser.__init__(self)
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skip_tags:
+            self.skipping += 1
+        elif tag in self.block_tags:
+            self.parts.append(u'\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.skip_tags:
+            self.skipping = max(self.skipping - 1, 0)
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+    def handle_entityref(self, name):
+        # Only called when the parser doesn't convert character references itself.
+        if name in name2codepoint:
+            self.handle_data(six.unichr(name2codepoint[name]))
+
+    def handle_charref(self, name):
+        try:
+            if name.lower().startswith('x'):
+                self.handle_data(six.unichr(int(name[1:], 16)))
+            else:
+                self.handle_data(six.unichr(int(name)))
+        except (ValueError, OverflowError):
+            pass
+
+    def get_text(self):
+        lines = (WHITESPACE_RE.sub(u' ', line).strip() for line in u''.join(self.parts).splitlines())
+        return u'\n'.join(line for line in lines if line)
+
+
+def html_to_text(html):
+    """
+    Convert html to plain text.
+
+    Args:
+      html (unicode): html document.
+
+    Returns:
+      Visible text of the document.
+    """
+    extractor = HTMLTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.get_text()
+
+
+def decode_bytes(data, charset=None):
+    """
+    Decode bytes with given charset, falling back to utf-8 and latin-1.
+    """
+    for encoding in (charset, 'utf-8'):
+        if not encoding:
+            continue
+        try:
+            return data.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return data.decode('latin-1')
+
+
+def decode_header_value(value):
+    """
+    Decode a (possibly RFC 2047 encoded) header to unicode.
+    """
+    if not value:
+        return u''
+    parts = []
+    for data, charset in decode_header(value):
+        if isinstance(data, six.binary_type):
+            data = decode_bytes(data, charset)
+        parts.append(data)
+    return WHITESPACE_RE.sub(u' ', u''.join(parts)).strip()
+
+
+def decode_raw(raw):
+    """
+    Decode the base64url ``raw`` field of a Gmail message to bytes.
+    """
+    if isinstance(raw, six.text_type):
+        raw = raw.encode('ascii')
+    return base64.urlsafe_b64decode(raw + b'=' * (-len(raw) % 4))
+
+
+def parse_message(payload):
+    """
+    Parse a Gmail message resource fetched with ``format=raw``.
+
+    Args:
+      payload (dict): message resource as returned by the Gmail api.
+
+    Returns:
+      dict with the normalized message.
+    """
+    message = message_from_bytes(decode_raw(payload['raw']))
+
+    text_parts, html_parts = [], []
+    for part in message.walk():
+        if part.is_multipart() or part.get_filename():
+            continue
+        content_type = part.get_content_type()
+        if content_type not in ('text/plain', 'text/html'):
+            continue
+        data = part.get_payload(decode=True)
+        if data is None:
+            continue
+        text = decode_bytes(data, part.get_content_charset())
+        (text_parts if content_type == 'text/plain' else html_parts).append(text)
+
+    body_text = u'\n'.join(text_parts).strip()
+    body_html = u'\n'.join(html_parts).strip()
+    if not body_text and body_html:
+        body_text = html_to_text(body_html)
+
+    subject = decode_header_value(message.get('Subject'))
+    sender = decode_header_value(message.get('From'))
+    to = decode_header_value(message.get('To'))
+
+    snippet = payload.get('snippet') or WHITESPACE_RE.sub(u' ', body_text)[:SNIPPET_LENGTH]
+    search_text = WHITESPACE_RE.sub(u' ', u' '.join((subject, sender, to, body_text))).strip().lower()
+
+    return {
+        'id': payload.get('id'),
+        'thread_id': payload.get('threadId'),
+        'label_ids': payload.get('labelIds', []),
+        'history_id': payload.get('historyId'),
+        'message_id': decode_header_value(message.get('Message-ID')),
+        'subject': subject,
+        'sender': sender,
+        'to': to,
+        'date': decode_header_value(message.get('Date')),
+        'snippet': snippet.strip(),
+        'body_text': body_text,
+        'body_html': body_html,
+        'search_text': search_text,
+    }
+
+
+def parse_messages(payloads):
+    """
+    Parse a chunk of messages, module level so it can be sent to worker processes.
+    """
+    return [parse_message(payload) for payload in payloads]
+
+
+class MessageProcessor(object):
+    """
+    Parse raw messages in a pool of worker processes.
+
+    The incoming iterable (normally the fetch stage) is only consumed while
+    fewer than ``max_pending`` chunks are waiting on the pool, so a fast fetcher
+    can't pile up unparsed messages in memory. Chunks smaller than
+    ``inline_threshold`` are parsed in the calling process.
+
+    Usage:
+
+        with MessageProcessor() as processor:
+            for record in processor.imap(fetch_raw_messages()):
+                ...
+    """
+    def __init__(self, processes=None, chunk_size=None, inline_threshold=None, max_pending=None):
+        self.processes = processes or gmail_settings.PROCESS_POOL_SIZE or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size or gmail_settings.PROCESS_CHUNK_SIZE
+        if inline_threshold is None:
+            inline_threshold = gmail_settings.PROCESS_INLINE_THRESHOLD
+        self.inline_threshold = inline_threshold
+        self.max_pending = max_pending or gmail_settings.PROCESS_MAX_PENDING_CHUNKS or self.processes * 2
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+        return self._pool
+
+    def imap(self, payloads):
+        """
+        Parse payloads, yielding records in the order of the input.
+
+        Args:
+          payloads (iterable): Gmail message resources fetched with ``format=raw``.
+
+        Returns:
+          Generator of parsed messages.
+        """
+        pending = collections.deque()
+        for chunk in chunked(payloads, self.chunk_size):
+            if len(chunk) < self.inline_threshold and not pending:
+                for record in parse_messages(chunk):
+                    yield record
+                continue
+
+            pending.append(self.pool.apply_async(parse_messages, (chunk,)))
+            while len(pending) >= self.max_pending:
+                for record in pending.popleft().get():
+                    yield record
+
+        while pending:
+            for record in pending.popleft().get():
+                yield record
+
+    def process(self, payloads):
+        """
+        Parse payloads and return the records as a list.
+        """
+        return list(self.imap(payloads))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self.close()
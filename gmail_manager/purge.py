@@ -0,0 +1,248 @@
+"""
+Permanently remove EmailAccounts that were soft deleted a while ago.
+
+``DeletedMixin.delete`` only flags accounts, and ``delete(hard=True)`` lets the
+ORM collect and delete every related row in one transaction. The purge
+instead deletes the data of an account in small batches of raw ``DELETE``
+statements, each in its own short transaction, pausing between batches so it
+doesn't hold long locks or load the database. Rows are selected first and
+deleted by primary key, which works on every database Django supports.
+
+Every batch locks the account row and checks it's still deleted first, and
+``EmailAccount.create_account_from_credentials`` takes the same lock before it
+undeletes the account and stores new credentials. So an account its owner
+reconnects is never purged and its new token is never revoked.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .models import ChangeEvent, EmailAccount, GmailCredentialsModel, Message, MessageBody, SyncState
+from .routers import use_primary
+from .settings import gmail_settings
+
+logger = logging.getLogger(__name__)
+
+
+class PurgeAborted(Exception):
+    """
+    The account being purged is no longer soft deleted.
+    """
+
+
+class Purger(object):
+    """
+    Delete soft deleted accounts and their data in bounded batches.
+    """
+    def __init__(self, batch_size=None, pause=None, revoke=True):
+        self.batch_size = batch_size or gmail_settings.PURGE_BATCH_SIZE
+        self.pause = gmail_settings.PURGE_PAUSE if pause is None else pause
+        self.revoke = revoke
+        self.using = router.db_for_write(EmailAccount)
+        self.connection = connections[self.using]
+
+    def table(self, model):
+        return self.connection.ops.quote_name(model._meta.db_table)
+
+    def column(self, model, field_name):
+        return self.connection.ops.quote_name(model._meta.get_field(field_name).column)
+
+    def execute(self, sql, params):
+        with transaction.atomic(using=self.using):
+            with self.connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.rowcount
+
+    def sleep(self):
+        if self.pause:
+            time.sleep(self.pause)
+
+    def placeholders(self, values):
+        return ', '.join(['%s'] * len(values))
+
+    def select_batch(self, model, field_name, value, *columns):
+        """
+        Select the first ``batch_size`` rows of model where field equals value.
+
+        Returns:
+            list of rows with the pk followed by given columns.
+        """
+        sql = 'SELECT {columns} FROM {table} WHERE {field} = %s LIMIT %s'.format(
+            columns=', '.join([self.column(model, model._meta.pk.name)] + [self.column(model, c) for c in columns]),
+            table=self.table(model),
+            field=self.column(model, field_name),
+        )
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, [value, self.batch_size])
+            return cursor.fetchall()
+
+    def delete_sql(self, model, pks):
+        return 'DELETE FROM {table} WHERE {pk} IN ({pks})'.format(
+            table=self.table(model),
+            pk=self.column(model, model._meta.pk.name),
+            pks=self.placeholders(pks),
+        )
+
+    @contextmanager
+    def locked(self, account_id, cutoff):
+        """
+        Run a block in a transaction that holds the account row lock.
+
+        Raises:
+            PurgeAborted: when the account isn't soft deleted since before cutoff anymore.
+        """
+        with transaction.atomic(using=self.using):
+            purgeable = EmailAccount.objects.using(self.using).select_for_update().filter(
+                pk=account_id,
+                is_deleted=True,
+                deleted__lt=cutoff,
+            ).values_list('pk', flat=True)
+            if not list(purgeable):
+                raise PurgeAborted(account_id)
+            yield
+
+    def delete_in_batches(self, model, field_name, account_id, cutoff):
+        """
+        Delete all rows of model where field equals the account id, ``batch_size`` rows at a time.
+
+        Returns:
+            number of deleted rows.
+        """
+        total = 0
+        while True:
+            with self.locked(account_id, cutoff):
+                pks = [row[0] for row in self.select_batch(model, field_name, account_id)]
+                if not pks:
+                    return total
+                self.execute(self.delete_sql(model, pks), pks)
+            total += len(pks)
+            if len(pks) < self.batch_size:
+                return total
+            self.sleep()
+
+    def delete_messages(self, account_id, cutoff):
+        """
+        Delete the messages of an account and the bodies no other account refers to.
+
+        Returns:
+            number of deleted messages.
+        """
+        message_table = self.table(Message)
+        body_column = self.column(Message, 'body')
+        body_pk = self.column(MessageBody, MessageBody._meta.pk.name)
+
+        total = 0
+        while True:
+            with self.locked(account_id, cutoff):
+                rows = self.select_batch(Message, 'account', account_id, 'body')
+                if not rows:
+                    return total
+
+                message_ids = [row[0] for row in rows]
+                body_ids = list(set(row[1] for row in rows if row[1] is not None))
+                with self.connection.cursor() as cursor:
+                    cursor.execute(self.delete_sql(Message, message_ids), message_ids)
+                    if body_ids:
+                        cursor.execute(
+                            '{delete} AND NOT EXISTS '
+                            '(SELECT 1 FROM {messages} WHERE {messages}.{body} = {bodies}.{body_pk})'.format(
+                                delete=self.delete_sql(MessageBody, body_ids),
+                                bodies=self.table(MessageBody), body_pk=body_pk,
+                                messages=message_table, body=body_column),
+                            body_ids,
+                        )
+            total += len(message_ids)
+            self.sleep()
+
+    def revoke_credentials(self, account):
+        """
+        Revoke the OAuth2 token of an account at Google, failures are logged and ignored.
+        """
+        import httplib2
+
+        try:
+            credentials = account.get_credentials()
+            if credentials is not None:
+                credentials.revoke(httplib2.Http())
+        except Exception:
+            logger.warning('Could not revoke credentials of EmailAccount %s', account.pk, exc_info=True)
+
+    def purge_account(self, account_id, cutoff):
+        """
+        Remove an account and everything stored for it.
+
+        The token is revoked and every batch is deleted while holding the
+        account row lock, after checking the account is still deleted, so an
+        account its owner reconnects during the purge is left alone from then on.
+
+        Arguments:
+            account_id (int): id of a soft deleted EmailAccount
+            cutoff (datetime): the account must be deleted before this moment
+
+        Returns:
+            True if the account was purged.
+        """
+        try:
+            if self.revoke:
+                with self.locked(account_id, cutoff), use_primary():
+                    self.revoke_credentials(EmailAccount.objects.using(self.using).get(pk=account_id))
+
+            messages = self.delete_messages(account_id, cutoff)
+            events = self.delete_in_batches(ChangeEvent, 'account', account_id, cutoff)
+            self.delete_in_batches(SyncState, 'account', account_id, cutoff)
+            self.delete_in_batches(GmailCredentialsModel, 'id', account_id, cutoff)
+
+            with self.locked(account_id, cutoff):
+                deleted = self.execute(
+                    'DELETE FROM {table} WHERE {pk} = %s'.format(
+                        table=self.table(EmailAccount),
+                        pk=self.column(EmailAccount, 'id')),
+                    [account_id],
+                )
+        except PurgeAborted:
+            logger.warning('EmailAccount %s is no longer deleted, stopped purging it', account_id)
+            return False
+
+        logger.info('Purged EmailAccount %s: %s messages, %s change events', account_id, messages, events)
+        return bool(deleted)
+
+    def purge(self, retention=None, limit=None):
+        """
+        Purge accounts that were soft deleted longer than retention ago.
+
+        Arguments:
+            retention (timedelta): how long deleted accounts are kept, defaults to ``PURGE_RETENTION_DAYS``
+            limit (int): maximum number of accounts to purge
+
+        Returns:
+            number of purged accounts.
+        """
+        if retention is None:
+            retention = timedelta(days=gmail_settings.PURGE_RETENTION_DAYS)
+        cutoff = timezone.now() - retention
+
+        # ``deleted`` is a modification date, but sync checkpoints no longer
+        # touch the account row, so it's the moment the account was deleted.
+        account_ids = EmailAccount.objects.using(self.using).filter(
+            is_deleted=True,
+            deleted__lt=cutoff,
+        ).order_by('pk').values_list('pk', flat=True)
+        if limit:
+            account_ids = account_ids[:limit]
+
+        count = 0
+        for account_id in list(account_ids):
+            if self.purge_account(account_id, cutoff):
+                count += 1
+        return count
+
+
+def purge_deleted_accounts(retention=None, limit=None, **kwargs):
+    """
+    Purge soft deleted accounts, see ``Purger``.
+    """
+    return Purger(**kwargs).purge(retention=retention, limit=limit)
@@ -0,0 +1,123 @@
+"""
+Database router sending mailbox reads to replicas and everything else to the primary.
+
+Add it to your project settings together with the middleware:
+
+DATABASE_ROUTERS = ['gmail_manager.routers.ReplicaRouter']
+MIDDLEWARE_CLASSES = (
+    'gmail_manager.routers.PinningMiddleware',
+    ...
+)
+GMAIL_MANAGER = {
+    'PRIMARY_DATABASE': 'default',
+    'REPLICA_DATABASES': ['replica1', 'replica2'],
+}
+
+After a write in a request, reads go to the primary for the rest of the
+request, and the middleware keeps the user pinned for ``PIN_PRIMARY_SECONDS``
+on the next requests, so a user never misses their own changes because of
+replication lag. Writes outside a request (sync workers, background jobs,
+management commands) don't pin anything, wrap their code in ``use_primary``
+where they need to read their own writes.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from .settings import gmail_settings
+
+APP_LABEL = 'gmail_manager'
+
+PIN_COOKIE = 'gmail_manager_primary'
+
+# Models that are always read from the primary, workers read their own writes in them.
+PRIMARY_ONLY_MODELS = ('syncstate',)
+
+_locals = threading.local()
+
+
+def pin_this_thread():
+    """
+    Send all reads of the current thread to the primary.
+    """
+    _locals.pinned = True
+
+
+def unpin_this_thread():
+    _locals.pinned = False
+    _locals.wrote = False
+
+
+def this_thread_wrote():
+    return getattr(_locals, 'wrote', False)
+
+
+def this_thread_in_request():
+    return getattr(_locals, 'in_request', False)
+
+
+def this_thread_is_pinned():
+    return getattr(_locals, 'pinned', False)
+
+
+@contextmanager
+def use_primary():
+    """
+    Read from the primary within the block, eg. in sync workers.
+    """
+    pinned = this_thread_is_pinned()
+    pin_this_thread()
+    try:
+        yield
+    finally:
+        _locals.pinned = pinned
+
+
+class ReplicaRouter(object):
+    """
+    Route reads of gmail_manager models to a random replica, writes to the primary.
+    """
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+        replicas = gmail_settings.REPLICA_DATABASES
+        if not replicas or this_thread_is_pinned() or model._meta.model_name in PRIMARY_ONLY_MODELS:
+            return gmail_settings.PRIMARY_DATABASE
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+        if this_thread_in_request():
+            pin_this_thread()
+            _locals.wrote = True
+        return gmail_settings.PRIMARY_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = [gmail_settings.PRIMARY_DATABASE] + list(gmail_settings.REPLICA_DATABASES)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in gmail_settings.REPLICA_DATABASES:
+            return False
+        return None
+
+
+class PinningMiddleware(object):
+    """
+    Keep a user on the primary for a while after a request that wrote data.
+    """
+    def process_request(self, request):
+        unpin_this_thread()
+        _locals.in_request = True
+        if request.COOKIES.get(PIN_COOKIE):
+            pin_this_thread()
+
+    def process_response(self, request, response):
+        if this_thread_wrote():
+            response.set_cookie(PIN_COOKIE, 'y', max_age=gmail_settings.PIN_PRIMARY_SECONDS)
+        unpin_this_thread()
+        _locals.in_request = False
+        return response
@@ -26,7 +26,47 @@ DEFAULTS = {
     'CLIENT_ID': '',
     'CLIENT_SECRET': '',
     'CALLBACK_URL': 'http://localhost:8000/gmailmanager/callback/',
-    'REDIRECT_URL': '/'
+    'REDIRECT_URL': '/',
+
+    # Message processing, see ``processing.MessageProcessor``
+    'PROCESS_POOL_SIZE': None,  # defaults to the number of cpus
+    'PROCESS_CHUNK_SIZE': 50,
+    'PROCESS_INLINE_THRESHOLD': 20,
+    'PROCESS_MAX_PENDING_CHUNKS': None,  # defaults to twice the pool size
+
+    # Store change events in the ``ChangeEvent`` outbox, see ``changes.emit_changes``
+    'CHANGE_OUTBOX': False,
+    'CHANGE_OUTBOX_RETENTION_DAYS': 7,  # see ``changes.prune_changes``
+
+    # Database routing, see ``routers.ReplicaRouter``
+    'PRIMARY_DATABASE': 'default',
+    'REPLICA_DATABASES': (),
+    'PIN_PRIMARY_SECONDS': 15,
+
+    # Mailbox export, see ``export.export_account``
+    'EXPORT_CONCURRENCY': 4,
+    'EXPORT_PAGE_SIZE': 100,
+
+    # Purge of soft deleted accounts, see ``purge.Purger``
+    'PURGE_RETENTION_DAYS': 30,
+    'PURGE_BATCH_SIZE': 1000,
+    'PURGE_PAUSE': 0.1,  # seconds between batches
+
+    # Read-ahead of threads, see ``prefetch.Prefetcher``
+    'PREFETCH_TOP_N': 5,
+    'PREFETCH_CACHE_SIZE': 1000,
+    'PREFETCH_TTL': 300,  # seconds
+    'PREFETCH_QUOTA_UNITS': 100,
+    'PREFETCH_QUOTA_WINDOW': 60,  # seconds
+    'PREFETCH_WORKERS': 4,
+
+    # Jobs queued by the admin actions, see ``jobs.run_pending_jobs``
+    'JOB_TIMEOUT_SECONDS': 3600,  # a job started this long ago without finishing is run again
+
+    # Sync health endpoint, see ``views.SyncHealthView``
+    'HEALTH_LAG_SECONDS': 3600,  # accounts not synced for this long are lagging
+    'HEALTH_PAGE_SIZE': 100,
+    'ADMIN_EXACT_COUNT_BELOW': 10000,  # admin lists estimated to be smaller are counted exactly
 }
 
 
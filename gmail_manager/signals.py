@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# Sent once per applied sync chunk of an EmailAccount, see ``changes.emit_changes``.
+messages_changed = Signal(providing_args=['account', 'added', 'removed', 'relabeled', 'history_id'])
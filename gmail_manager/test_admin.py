@@ -0,0 +1,185 @@
+import json
+from datetime import timedelta
+
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import TestCase, RequestFactory
+from django.utils import timezone
+from mock import MagicMock, patch
+
+from .admin import EmailAccountAdmin, EstimatedCountPaginator
+from .jobs import queue_job, reauthorize_accounts, resync_accounts, run_pending_jobs, soft_delete_accounts
+from .models import AccountJob, EmailAccount, SyncState
+from .views import SyncHealthView
+
+
+class HealthTestCase(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.staff = User.objects.create_user(
+            username='jacob', email='jacob@_', password='top_secret')
+        self.staff.is_staff = True
+        self.staff.save()
+
+        self.accounts = []
+        for i in range(3):
+            account = EmailAccount.objects.create(
+                owner=self.staff, email_address='jacob%s@example.com' % i, is_authorized=True)
+            SyncState.objects.create(account=account, history_id=10, last_sync_finished=timezone.now())
+            self.accounts.append(account)
+
+    def get(self, **params):
+        request = self.factory.get(reverse('gmail_health'), params)
+        request.user = self.staff
+        return SyncHealthView.as_view()(request)
+
+
+class SyncHealthViewTestCase(HealthTestCase):
+    def test_requires_staff(self):
+        self.staff.is_staff = False
+
+        response = self.get()
+        self.assertEqual(response.status_code, 302)
+
+    def test_keyset_pagination(self):
+        first = json.loads(self.get(limit=2).content.decode('utf-8'))
+        second = json.loads(self.get(limit=2, after=first['next']).content.decode('utf-8'))
+
+        self.assertEqual([account['id'] for account in first['accounts']], [a.pk for a in self.accounts[:2]])
+        self.assertEqual([account['id'] for account in second['accounts']], [self.accounts[2].pk])
+        self.assertIsNone(second['next'])
+        self.assertIn('estimated_total', first)
+
+    def test_limit_is_at_least_one(self):
+        for limit in (0, -5):
+            data = json.loads(self.get(limit=limit).content.decode('utf-8'))
+
+            self.assertEqual([account['id'] for account in data['accounts']], [self.accounts[0].pk])
+            self.assertEqual(data['next'], self.accounts[0].pk)
+
+    def test_rejects_invalid_limit(self):
+        self.assertEqual(self.get(limit='many').status_code, 400)
+
+    def test_reports_prefetch_stats(self):
+        data = json.loads(self.get().content.decode('utf-8'))
+
+        self.assertIn('hit_rate', data['prefetch'])
+        self.assertIn('misses', data['prefetch'])
+        self.assertIn('pid', data['prefetch'])
+
+    def test_filters_on_status(self):
+        SyncState.objects.filter(pk=self.accounts[1].pk).update(
+            error_count=2, last_error='boom', last_sync_finished=timezone.now() - timedelta(days=1))
+
+        for status in ('errors', 'lagging'):
+            data = json.loads(self.get(status=status).content.decode('utf-8'))
+            self.assertEqual([account['id'] for account in data['accounts']], [self.accounts[1].pk])
+        self.assertEqual(data['accounts'][0]['last_error'], 'boom')
+        self.assertGreater(data['accounts'][0]['sync_lag'], 3600)
+
+    def test_rejects_unknown_status(self):
+        self.assertEqual(self.get(status='happy').status_code, 400)
+
+
+class JobsTestCase(HealthTestCase):
+    def test_resync_resets_sync_state(self):
+        resync_accounts([self.accounts[0].pk])
+
+        self.assertIsNone(SyncState.objects.get(pk=self.accounts[0].pk).history_id)
+        self.assertEqual(SyncState.objects.get(pk=self.accounts[1].pk).history_id, 10)
+
+    def test_reauthorize(self):
+        reauthorize_accounts([self.accounts[0].pk])
+
+        self.assertFalse(EmailAccount.objects.get(pk=self.accounts[0].pk).is_authorized)
+
+    def test_soft_delete(self):
+        soft_delete_accounts([self.accounts[0].pk])
+
+        self.assertTrue(EmailAccount.objects.get(pk=self.accounts[0].pk).is_deleted)
+
+    def test_run_pending_jobs(self):
+        job = queue_job(AccountJob.REAUTHORIZE, EmailAccount.objects.exclude(pk=self.accounts[2].pk))
+
+        self.assertEqual(run_pending_jobs(), 1)
+        self.assertEqual(run_pending_jobs(), 0)
+
+        job = AccountJob.objects.get(pk=job.pk)
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(job.error, '')
+        self.assertEqual(EmailAccount.objects.filter(is_authorized=False).count(), 2)
+
+    @patch('gmail_manager.jobs.CHUNK_SIZE', 2)
+    def test_job_resolves_accounts_in_chunks(self):
+        queue_job(AccountJob.RESYNC, EmailAccount.objects.filter(is_deleted=False))
+        resync = MagicMock()
+
+        with patch.dict('gmail_manager.jobs.JOBS', {AccountJob.RESYNC: resync}):
+            run_pending_jobs()
+
+        self.assertEqual([call[0][0] for call in resync.call_args_list],
+                         [[a.pk for a in self.accounts[:2]], [self.accounts[2].pk]])
+
+    def test_failed_job_is_recorded(self):
+        job = queue_job(AccountJob.RESYNC, EmailAccount.objects.filter(pk=self.accounts[0].pk))
+
+        with patch.dict('gmail_manager.jobs.JOBS', {AccountJob.RESYNC: MagicMock(side_effect=Exception('boom'))}):
+            run_pending_jobs()
+
+        job = AccountJob.objects.get(pk=job.pk)
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(job.error, 'boom')
+
+    def test_started_job_is_not_run_twice(self):
+        job = queue_job(AccountJob.RESYNC, EmailAccount.objects.filter(pk=self.accounts[0].pk))
+        AccountJob.objects.filter(pk=job.pk).update(started=timezone.now())
+
+        self.assertEqual(run_pending_jobs(), 0)
+
+        # Until its runner is presumed dead.
+        AccountJob.objects.filter(pk=job.pk).update(started=timezone.now() - timedelta(days=1))
+        self.assertEqual(run_pending_jobs(), 1)
+
+
+class EmailAccountAdminTestCase(HealthTestCase):
+    def setUp(self):
+        super(EmailAccountAdminTestCase, self).setUp()
+        self.admin = EmailAccountAdmin(EmailAccount, AdminSite())
+        self.admin.message_user = MagicMock()
+
+    def test_actions_queue_jobs(self):
+        request = self.factory.get('/')
+        queryset = EmailAccount.objects.filter(pk=self.accounts[0].pk)
+
+        self.admin.resync(request, queryset)
+
+        job = AccountJob.objects.get()
+        self.assertEqual(job.action, AccountJob.RESYNC)
+        self.assertEqual(list(job.get_queryset().values_list('pk', flat=True)), [self.accounts[0].pk])
+        self.assertIsNone(job.started)
+
+    def test_hard_delete_action_is_removed(self):
+        request = self.factory.get('/')
+        request.user = self.staff
+        self.staff.is_superuser = True
+
+        self.assertNotIn('delete_selected', self.admin.get_actions(request))
+        self.assertIn('soft_delete', self.admin.get_actions(request))
+
+
+class EstimatedCountPaginatorTestCase(HealthTestCase):
+    @patch('gmail_manager.admin.estimate_count', return_value=5000000)
+    def test_large_filtered_list_is_estimated(self, mock_estimate):
+        queryset = EmailAccount.objects.filter(is_deleted=False)
+
+        with patch.object(type(queryset), 'count') as mock_count:
+            self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 5000000)
+
+        self.assertFalse(mock_count.called)
+
+    @patch('gmail_manager.admin.estimate_count', return_value=2)
+    def test_small_list_is_counted_exactly(self, mock_estimate):
+        queryset = EmailAccount.objects.filter(is_deleted=False)
+
+        self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 3)
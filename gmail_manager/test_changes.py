@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from mock import MagicMock, patch
+
+from .changes import changes_since, emit_changes, prune_changes
+from .models import ChangeEvent, EmailAccount
+from .settings import gmail_settings
+from .signals import messages_changed
+
+
+class EmitChangesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@_', password='top_secret')
+        self.account = EmailAccount.objects.create(owner=self.user, email_address='jacob@example.com')
+        self.receiver = MagicMock()
+        messages_changed.connect(self.receiver)
+        self.addCleanup(messages_changed.disconnect, self.receiver)
+
+    def test_sends_one_signal_per_chunk(self):
+        emit_changes(self.account, added=['a', 'b'], removed=['c'], history_id=10)
+
+        self.assertEqual(self.receiver.call_count, 1)
+        kwargs = self.receiver.call_args[1]
+        self.assertEqual(kwargs['added'], ['a', 'b'])
+        self.assertEqual(kwargs['removed'], ['c'])
+        self.assertEqual(kwargs['relabeled'], [])
+        self.assertEqual(kwargs['history_id'], 10)
+
+    def test_empty_chunk_is_ignored(self):
+        self.assertIsNone(emit_changes(self.account, history_id=10))
+        self.assertFalse(self.receiver.called)
+
+    def test_outbox_disabled_by_default(self):
+        emit_changes(self.account, added=['a'], history_id=10)
+
+        self.assertFalse(ChangeEvent.objects.exists())
+
+    @patch.object(gmail_settings, 'CHANGE_OUTBOX', True)
+    def test_outbox_can_be_read_from_cursor(self):
+        first = emit_changes(self.account, added=['a'], history_id=10)
+        emit_changes(self.account, relabeled=['a', 'b'], history_id=11)
+
+        events = changes_since(self.account, cursor=first.pk)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].relabeled_ids, ['a', 'b'])
+        self.assertEqual(events[0].history_id, 11)
+
+    def test_prune_removes_old_events(self):
+        old = ChangeEvent.objects.create(account=self.account, added='a')
+        ChangeEvent.objects.filter(pk=old.pk).update(created=timezone.now() - timedelta(days=8))
+        new = ChangeEvent.objects.create(account=self.account, added='b')
+
+        self.assertEqual(prune_changes(timedelta(days=7), batch_size=1), 1)
+        self.assertEqual(list(ChangeEvent.objects.values_list('pk', flat=True)), [new.pk])
@@ -0,0 +1,153 @@
+import base64
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from mock import MagicMock, patch
+
+from .dedup import split_raw, store_body, sync_message
+from .models import EmailAccount, MessageBody, SyncState
+
+RAW = b'Delivered-To: %s\r\nMessage-ID: %s\r\nSubject: Hi\r\n\r\n%s'
+
+# Long signature header, Gmail returns it unfolded in the metadata.
+ARC_PARTS = [(u'i=1; a=rsa-sha256; c=relaxed/relaxed; d=example.com; s=arc-%s' % i).encode('ascii') for i in range(20)]
+ARC_FOLDED = b'ARC-Message-Signature: ' + b'\r\n\t'.join(ARC_PARTS) + b'\r\n'
+ARC_UNFOLDED = b' '.join(ARC_PARTS).decode('ascii')
+
+
+def make_service(address, rfc_message_id='<1@example.com>', content=b'Hello there\r\n', folded=False):
+    service = MagicMock()
+    get = service.users.return_value.messages.return_value.get
+    raw = RAW % (address.encode('ascii'), rfc_message_id.encode('ascii'), content)
+    headers = [
+        {'name': 'Delivered-To', 'value': address},
+        {'name': 'Message-ID', 'value': rfc_message_id},
+        {'name': 'Subject', 'value': 'Hi'},
+    ]
+    if folded:
+        raw = ARC_FOLDED + raw
+        headers.insert(0, {'name': 'ARC-Message-Signature', 'value': ARC_UNFOLDED})
+
+    def execute(userId, id, format):
+        response = MagicMock()
+        if format == 'metadata':
+            response.execute.return_value = {
+                'id': id,
+                'threadId': 't%s' % id,
+                'sizeEstimate': len(raw),
+                'snippet': content.decode('ascii').strip()[:200],
+                'payload': {'headers': headers},
+            }
+        else:
+            response.execute.return_value = {'id': id, 'raw': base64.urlsafe_b64encode(raw)}
+        return response
+
+    get.side_effect = execute
+    return service, get
+
+
+class SyncMessageTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@_', password='top_secret')
+        self.personal = EmailAccount.objects.create(owner=self.user, email_address='jacob@example.com')
+        self.team = EmailAccount.objects.create(owner=self.user, email_address='team@example.com')
+
+    def test_split_raw(self):
+        self.assertEqual(split_raw(b'A: b\nC: d\n\nbody\n\nmore'), (b'A: b\nC: d', b'body\n\nmore'))
+
+    @patch('gmail_manager.dedup.router')
+    def test_store_body_reads_from_primary(self, mock_router):
+        mock_router.db_for_write.return_value = 'default'
+
+        first = store_body(b'Hello there\r\n')
+        second = store_body(b'Hello there\r\n')
+
+        self.assertEqual(first.pk, second.pk)
+        mock_router.db_for_write.assert_called_with(MessageBody)
+        self.assertFalse(mock_router.db_for_read.called)
+
+    def test_fetches_raw_for_first_copy(self):
+        service, get = make_service('jacob@example.com')
+
+        message = sync_message(service, self.personal, 'a1')
+
+        self.assertEqual([call[1]['format'] for call in get.call_args_list], ['metadata', 'raw'])
+        self.assertEqual(bytes(message.body.content), b'Hello there\r\n')
+        self.assertEqual(message.get_raw(), RAW % (b'jacob@example.com', b'<1@example.com>', b'Hello there\r\n'))
+
+    def test_reuses_body_of_other_account(self):
+        sync_message(make_service('jacob@example.com')[0], self.personal, 'a1')
+        service, get = make_service('team@example.com')
+
+        message = sync_message(service, self.team, 'b1')
+
+        self.assertEqual([call[1]['format'] for call in get.call_args_list], ['metadata'])
+        self.assertEqual(MessageBody.objects.count(), 1)
+        self.assertEqual(message.get_raw(), RAW % (b'team@example.com', b'<1@example.com>', b'Hello there\r\n'))
+
+    def test_does_not_share_between_owners(self):
+        other = User.objects.create_user(username='other', email='other@_', password='top_secret')
+        account = EmailAccount.objects.create(owner=other, email_address='other@example.com')
+        sync_message(make_service('jacob@example.com')[0], self.personal, 'a1')
+        service, get = make_service('other@example.com')
+
+        sync_message(service, account, 'c1')
+
+        self.assertEqual([call[1]['format'] for call in get.call_args_list], ['metadata', 'raw'])
+        self.assertEqual(MessageBody.objects.count(), 1)
+
+    def test_different_content_is_fetched(self):
+        sync_message(make_service('jacob@example.com')[0], self.personal, 'a1')
+        service, get = make_service('team@example.com', content=b'Hello there\r\n--\r\nSent via the team list\r\n')
+
+        message = sync_message(service, self.team, 'b1')
+
+        self.assertEqual([call[1]['format'] for call in get.call_args_list], ['metadata', 'raw'])
+        self.assertEqual(MessageBody.objects.count(), 2)
+        self.assertIn(b'team list', bytes(message.body.content))
+
+    def test_equal_length_different_content_is_fetched(self):
+        sync_message(make_service('jacob@example.com', content=b'Hi Anna, your code is 1234\r\n')[0],
+                     self.personal, 'a1')
+        service, get = make_service('team@example.com', content=b'Hi Jake, your code is 9876\r\n')
+
+        message = sync_message(service, self.team, 'b1')
+
+        self.assertEqual([call[1]['format'] for call in get.call_args_list], ['metadata', 'raw'])
+        self.assertIn(b'Jake', bytes(message.body.content))
+
+    def test_folded_headers_are_shared(self):
+        sync_message(make_service('jacob@example.com', folded=True)[0], self.personal, 'a1')
+        service, get = make_service('team@example.com', folded=True)
+
+        message = sync_message(service, self.team, 'b1')
+
+        self.assertEqual([call[1]['format'] for call in get.call_args_list], ['metadata'])
+        self.assertEqual(bytes(message.body.content), b'Hello there\r\n')
+
+    def test_resync_of_own_message_is_not_fetched(self):
+        sync_message(make_service('jacob@example.com')[0], self.personal, 'a1')
+        service, get = make_service('jacob@example.com')
+
+        sync_message(service, self.personal, 'a1')
+
+        self.assertEqual([call[1]['format'] for call in get.call_args_list], ['metadata'])
+
+    def test_counts_quota_usage(self):
+        SyncState.objects.create(account=self.personal)
+        SyncState.objects.create(account=self.team)
+        sync_message(make_service('jacob@example.com')[0], self.personal, 'a1')
+        sync_message(make_service('team@example.com')[0], self.team, 'b1')
+
+        self.assertEqual(SyncState.objects.get(pk=self.personal.pk).quota_used, 10)
+        self.assertEqual(SyncState.objects.get(pk=self.team.pk).quota_used, 5)
+
+    def test_long_message_id_is_shared(self):
+        rfc_message_id = '<%s@example.com>' % ('x' * 300)
+        sync_message(make_service('jacob@example.com', rfc_message_id)[0], self.personal, 'a1')
+        service, get = make_service('team@example.com', rfc_message_id)
+
+        sync_message(service, self.team, 'b1')
+
+        self.assertEqual([call[1]['format'] for call in get.call_args_list], ['metadata'])
@@ -0,0 +1,190 @@
+import io
+import zipfile
+
+from django.contrib.auth.models import User, AnonymousUser
+from django.core.urlresolvers import reverse
+from django.http import Http404
+from django.test import SimpleTestCase, TestCase, RequestFactory
+from mock import MagicMock, patch
+
+from .export import EML, MBOX, ExportError, ExportState, MboxWriter, export_account, iter_messages, stream_account
+from .models import EmailAccount
+from .views import ExportMailboxView
+
+
+def fake_messages(account, state, concurrency=None):
+    for i in range(3):
+        message = {'id': str(i), 'internalDate': '1420070400000', 'raw': b'Subject: %d\r\n\r\nFrom here\r\n' % i}
+        yield message, ('', str(i))
+
+
+def make_list_service(pages):
+    """
+    Service of which messages().list returns given pages of ids, keyed by page token.
+    """
+    service = MagicMock()
+
+    def list_messages(userId, maxResults, includeSpamTrash, pageToken=''):
+        ids, next_page_token = pages[pageToken]
+        request = MagicMock()
+        request.execute.return_value = {
+            'messages': [{'id': pk} for pk in ids],
+            'nextPageToken': next_page_token,
+        }
+        return request
+
+    def get_message(userId, id, format):
+        request = MagicMock()
+        request.execute.return_value = {'id': id, 'raw': 'eA'}
+        return request
+
+    messages = service.users.return_value.messages.return_value
+    messages.list.side_effect = list_messages
+    messages.get.side_effect = get_message
+    return service
+
+
+class MboxWriterTestCase(SimpleTestCase):
+    def test_escapes_from_lines(self):
+        fileobj = io.BytesIO()
+
+        MboxWriter(fileobj).write({'raw': b'Subject: x\r\n\r\nFrom me\r\n>From you', 'internalDate': '0'})
+
+        self.assertEqual(
+            fileobj.getvalue(),
+            b'From MAILER-DAEMON Thu Jan  1 00:00:00 1970\nSubject: x\n\n>From me\n>>From you\n\n',
+        )
+
+
+@patch('gmail_manager.export.iter_messages', fake_messages)
+class ExportAccountTestCase(SimpleTestCase):
+    def test_export_updates_state(self):
+        state = ExportState()
+
+        export_account(None, io.BytesIO(), MBOX, state)
+
+        self.assertEqual(state.count, 3)
+        self.assertEqual(state.last_id, '2')
+        self.assertTrue(state.done)
+
+    def test_stream_zip(self):
+        data = b''.join(stream_account(None, EML))
+
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertEqual(archive.namelist(), ['0.eml', '1.eml', '2.eml'])
+        self.assertEqual(archive.read('1.eml'), b'Subject: 1\r\n\r\nFrom here\r\n')
+
+
+class IterMessagesTestCase(SimpleTestCase):
+    def setUp(self):
+        self.account = MagicMock()
+        self.account.get_credentials.return_value.invalid = False
+
+    def ids(self, pages, state):
+        with patch('gmail_manager.export.build_gmail_service', return_value=make_list_service(pages)):
+            return [message['id'] for message, position in iter_messages(self.account, state, concurrency=2)]
+
+    def test_resumes_after_last_written_message(self):
+        # m0 was deleted and n1 arrived since the export stopped after m1.
+        pages = {'': (['n1', 'm1', 'm2', 'm3'], 'p2'), 'p2': (['m4'], '')}
+
+        self.assertEqual(self.ids(pages, ExportState(last_id='m1', count=2)), ['m2', 'm3', 'm4'])
+
+    def test_skips_messages_pushed_to_next_page(self):
+        pages = {'': (['m1', 'm2'], 'p2'), 'p2': (['m2', 'm3'], '')}
+
+        self.assertEqual(self.ids(pages, ExportState()), ['m1', 'm2', 'm3'])
+
+    def test_counts_quota_usage(self):
+        pages = {'': (['m1', 'm2', 'm3'], 'p2'), 'p2': (['m4'], '')}
+
+        self.ids(pages, ExportState())
+
+        # Two list requests and four message gets.
+        self.assertEqual(sum(call[0][0] for call in self.account.add_quota_usage.call_args_list), 30)
+
+    def test_resumes_page_when_last_written_message_is_gone(self):
+        # m1 was deleted since the export stopped after it.
+        pages = {'': (['m0', 'm2', 'm3'], 'p2'), 'p2': (['m4'], '')}
+        state = ExportState(last_id='m1', count=2, page_ids=['m0', 'm1'])
+
+        self.assertEqual(self.ids(pages, state), ['m2', 'm3', 'm4'])
+
+    def test_state_tracks_written_ids_of_page(self):
+        state = ExportState()
+        for position in [('', 'm0'), ('', 'm1'), ('p2', 'm2')]:
+            state.advance(position)
+
+        self.assertEqual(state.page_token, 'p2')
+        self.assertEqual(state.page_ids, ['m2'])
+        self.assertEqual(ExportState.from_dict(state.to_dict()).page_ids, ['m2'])
+
+    def test_fails_without_credentials(self):
+        self.account.get_credentials.return_value = None
+
+        with self.assertRaises(ExportError):
+            self.ids({}, ExportState())
+
+
+class ExportMailboxViewTestCase(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@_', password='top_secret')
+        self.account = EmailAccount.objects.create(owner=self.user, email_address='jacob@example.com')
+
+    def test_export_redirects_anon_user(self):
+        request = self.factory.get(reverse('gmail_export', args=[self.account.pk]))
+        request.user = AnonymousUser()
+
+        response = ExportMailboxView.as_view()(request, pk=str(self.account.pk))
+        self.assertEqual(response.status_code, 302)
+
+    def test_export_only_own_accounts(self):
+        other = User.objects.create_user(username='other', email='other@_', password='top_secret')
+        request = self.factory.get(reverse('gmail_export', args=[self.account.pk]))
+        request.user = other
+
+        with self.assertRaises(Http404):
+            ExportMailboxView.as_view()(request, pk=str(self.account.pk))
+
+    def test_export_rejects_unauthorized_account(self):
+        request = self.factory.get(reverse('gmail_export', args=[self.account.pk]))
+        request.user = self.user
+
+        with patch('gmail_manager.export.stream_account') as mock_stream:
+            response = ExportMailboxView.as_view()(request, pk=str(self.account.pk))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(mock_stream.called)
+
+    def test_export_rejects_missing_credentials(self):
+        EmailAccount.objects.filter(pk=self.account.pk).update(is_authorized=True)
+        request = self.factory.get(reverse('gmail_export', args=[self.account.pk]))
+        request.user = self.user
+
+        with patch.object(EmailAccount, 'get_credentials', return_value=None):
+            response = ExportMailboxView.as_view()(request, pk=str(self.account.pk))
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_rejects_unknown_format(self):
+        request = self.factory.get('%s?format=pdf' % reverse('gmail_export', args=[self.account.pk]))
+        request.user = self.user
+
+        response = ExportMailboxView.as_view()(request, pk=str(self.account.pk))
+        self.assertEqual(response.status_code, 400)
+
+    @patch('gmail_manager.export.stream_account', return_value=iter([b'From ', b'x\n']))
+    def test_export_streams_archive(self, mock_stream):
+        EmailAccount.objects.filter(pk=self.account.pk).update(is_authorized=True)
+        credentials = MagicMock(invalid=False)
+        request = self.factory.get(reverse('gmail_export', args=[self.account.pk]))
+        request.user = self.user
+
+        with patch.object(EmailAccount, 'get_credentials', return_value=credentials):
+            response = ExportMailboxView.as_view()(request, pk=str(self.account.pk))
+
+        self.assertEqual(b''.join(response.streaming_content), b'From x\n')
+        self.assertEqual(response['Content-Type'], 'application/mbox')
+        mock_stream.assert_called_once_with(self.account, MBOX)
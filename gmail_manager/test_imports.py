@@ -0,0 +1,72 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.test import SimpleTestCase
+
+# Seconds importing the app may take on top of Django, override for slow machines.
+IMPORT_TIME_BUDGET = float(os.environ.get('GMAIL_MANAGER_IMPORT_BUDGET', 0.5))
+
+# Modules only needed once Gmail is contacted or an export/purge/prefetch runs.
+LAZY_MODULES = (
+    'googleapiclient',
+    'uritemplate',
+    'gmail_manager.export',
+    'gmail_manager.prefetch',
+    'gmail_manager.processing',
+    'gmail_manager.purge',
+    'multiprocessing.pool',
+)
+
+# Runs in a fresh interpreter, the test process has most modules loaded already.
+BENCHMARK = """
+import json, sys, time
+import django
+django.setup()
+lazy = %r
+start = time.time()
+import gmail_manager.admin, gmail_manager.models, gmail_manager.urls, gmail_manager.views
+print(json.dumps({
+    'seconds': time.time() - start,
+    'modules': sorted(name for name in sys.modules
+                      if sys.modules[name] is not None and name.startswith(lazy)),
+}))
+""" % (LAZY_MODULES,)
+
+
+def benchmark_import():
+    """
+    Import the app in a new interpreter.
+
+    Returns:
+      dict with the import time in ``seconds`` and the ``LAZY_MODULES`` it loaded.
+    """
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'test_project.settings')
+    output = subprocess.check_output([sys.executable, '-c', BENCHMARK], env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+class ImportTimeTestCase(SimpleTestCase):
+    def test_import_does_not_load_lazy_modules(self):
+        result = benchmark_import()
+
+        self.assertEqual(result['modules'], [])
+
+    def test_import_time_within_budget(self):
+        # Best of three, the first run also pays for cold disk caches.
+        seconds = min(benchmark_import()['seconds'] for _ in range(3))
+        sys.stderr.write('\ngmail_manager import time: %.3fs (budget %.3fs)\n' % (seconds, IMPORT_TIME_BUDGET))
+
+        self.assertLess(seconds, IMPORT_TIME_BUDGET)
+
+    def test_flow_is_built_on_first_use(self):
+        from . import views
+
+        views.FLOW = None
+        self.addCleanup(setattr, views, 'FLOW', None)
+
+        flow = views.get_flow()
+        self.assertIsNotNone(flow)
+        self.assertIs(views.get_flow(), flow)
@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from .models import EmailAccount, SyncState
+
+
+class SyncStateTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@_', password='top_secret')
+        self.account = EmailAccount.objects.create(owner=self.user, email_address='jacob@example.com')
+        self.state = SyncState.objects.create(account=self.account)
+
+    def test_checkpoint_leaves_account_untouched(self):
+        modified = EmailAccount.objects.get(pk=self.account.pk).modified
+
+        self.state.checkpoint(history_id=42, page_token='next')
+
+        state = SyncState.objects.get(pk=self.state.pk)
+        self.assertEqual(state.temp_history_id, 42)
+        self.assertEqual(state.page_token, 'next')
+        self.assertEqual(EmailAccount.objects.get(pk=self.account.pk).modified, modified)
+
+    def test_finish_resets_cursor_and_errors(self):
+        self.state.checkpoint(history_id=42, page_token='next')
+        self.state.fail('boom')
+
+        self.state.finish(43)
+
+        state = SyncState.objects.get(pk=self.state.pk)
+        self.assertEqual(state.history_id, 43)
+        self.assertIsNone(state.temp_history_id)
+        self.assertEqual(state.page_token, '')
+        self.assertEqual(state.error_count, 0)
+        self.assertIsNotNone(state.last_sync_finished)
+
+    def test_fail_increments_error_count(self):
+        self.state.fail('boom')
+        self.state.fail('bang')
+
+        state = SyncState.objects.get(pk=self.state.pk)
+        self.assertEqual(state.error_count, 2)
+        self.assertEqual(state.last_error, 'bang')
+
+    def test_add_quota_usage_adds_up_per_day(self):
+        self.state.add_quota_usage(5)
+        self.state.add_quota_usage(10)
+
+        state = SyncState.objects.get(pk=self.state.pk)
+        self.assertEqual(state.quota_used, 15)
+        self.assertIsNotNone(state.quota_window_start)
+
+    def test_add_quota_usage_starts_new_window(self):
+        SyncState.objects.filter(pk=self.state.pk).update(
+            quota_used=500, quota_window_start=timezone.now() - timedelta(days=2))
+
+        self.state.add_quota_usage(5)
+
+        self.assertEqual(SyncState.objects.get(pk=self.state.pk).quota_used, 5)
+
+    def test_account_add_quota_usage(self):
+        self.account.add_quota_usage(10)
+
+        self.assertEqual(SyncState.objects.get(pk=self.state.pk).quota_used, 10)
+
+    def test_missing_row_is_created(self):
+        account = EmailAccount.objects.create(owner=self.user, email_address='other@example.com')
+        state = SyncState(account_id=account.pk)
+
+        state.fail('boom')
+        state.checkpoint(page_token='next')
+
+        state = SyncState.objects.get(pk=account.pk)
+        self.assertEqual(state.error_count, 1)
+        self.assertEqual(state.page_token, 'next')
+
+    def test_lease_on_missing_row(self):
+        account = EmailAccount.objects.create(owner=self.user, email_address='other@example.com')
+
+        self.assertTrue(SyncState(account_id=account.pk).acquire_lease('worker-1'))
+        self.assertFalse(SyncState(account_id=account.pk).acquire_lease('worker-2'))
+
+    def test_lease_is_exclusive(self):
+        self.assertTrue(self.state.acquire_lease('worker-1'))
+        self.assertFalse(self.state.acquire_lease('worker-2'))
+        self.assertTrue(self.state.acquire_lease('worker-1'))
+
+        self.state.release_lease('worker-1')
+        self.assertTrue(self.state.acquire_lease('worker-2'))
+
+    def test_expired_lease_can_be_taken_over(self):
+        self.assertTrue(self.state.acquire_lease('worker-1', duration=timedelta(seconds=-1)))
+        self.assertTrue(self.state.acquire_lease('worker-2'))
@@ -0,0 +1,137 @@
+from django.test import SimpleTestCase
+from mock import MagicMock, patch
+
+from .prefetch import Prefetcher, QuotaBudget, TTLCache
+
+
+def listing(*thread_ids, **history_ids):
+    return [{'id': pk, 'historyId': history_ids.get(pk, '1')} for pk in thread_ids]
+
+
+class TTLCacheTestCase(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+
+    @patch('gmail_manager.prefetch.time.time')
+    def test_items_expire(self, mock_time):
+        cache = TTLCache(max_size=2, ttl=60)
+        mock_time.return_value = 1000
+        cache.set('a', 1)
+
+        mock_time.return_value = 1061
+        self.assertNotIn('a', cache)
+        self.assertIsNone(cache.get('a'))
+
+
+class QuotaBudgetTestCase(SimpleTestCase):
+    @patch('gmail_manager.prefetch.time.time', return_value=1000)
+    def test_budget_resets_per_window(self, mock_time):
+        budget = QuotaBudget(units=25, window=60)
+
+        self.assertEqual(budget.take(1, 10, wanted=5), 2)
+        self.assertEqual(budget.take(1, 10, wanted=5), 0)
+        self.assertEqual(budget.take(2, 10, wanted=1), 1)
+
+        mock_time.return_value = 1060
+        self.assertEqual(budget.take(1, 10, wanted=5), 2)
+
+    def test_keeps_at_most_max_keys(self):
+        budget = QuotaBudget(units=25, window=60, max_keys=2)
+        for key in range(5):
+            budget.take(key, 10)
+
+        self.assertEqual(list(budget.spent), [3, 4])
+
+
+class PrefetcherTestCase(SimpleTestCase):
+    def setUp(self):
+        self.account = MagicMock(pk=1)
+        self.prefetcher = Prefetcher(top_n=2, cache_size=10, ttl=60, quota_units=100, quota_window=60, workers=1)
+        self.prefetcher.submit = lambda func, *args: func(*args)
+        self.prefetcher.fetch_threads = MagicMock(
+            side_effect=lambda account, ids: dict((pk, {'id': pk, 'historyId': '1'}) for pk in ids))
+
+    def test_prefetches_top_threads(self):
+        self.prefetcher.schedule(self.account, listing('t1', 't2', 't3'))
+
+        self.prefetcher.fetch_threads.assert_called_once_with(self.account, ['t1', 't2'])
+        self.assertEqual(self.prefetcher.get_thread(self.account, 't1'), {'id': 't1', 'historyId': '1'})
+        self.assertEqual(self.prefetcher.stats()['hits'], 1)
+        self.assertEqual(self.prefetcher.stats()['prefetched'], 2)
+
+    def test_counts_quota_usage(self):
+        self.prefetcher.schedule(self.account, listing('t1', 't2'))
+        service = MagicMock()
+        self.prefetcher.get_thread(self.account, 't9', service=service)
+
+        self.assertEqual([call[0][0] for call in self.account.add_quota_usage.call_args_list], [20, 10])
+
+    def test_changed_thread_is_prefetched_again(self):
+        self.prefetcher.schedule(self.account, listing('t1', 't2'))
+        self.prefetcher.fetch_threads.reset_mock()
+
+        # t2 got a reply and moved to the top.
+        self.prefetcher.schedule(self.account, listing('t2', 't1', t2='2'))
+
+        self.prefetcher.fetch_threads.assert_called_once_with(self.account, ['t2'])
+
+    def test_changed_thread_is_not_served_from_cache(self):
+        self.prefetcher.schedule(self.account, listing('t1'))
+        service = MagicMock()
+        service.users.return_value.threads.return_value.get.return_value.execute.return_value = {
+            'id': 't1', 'historyId': '2'}
+
+        thread = self.prefetcher.get_thread(self.account, 't1', service=service, history_id='2')
+
+        self.assertEqual(thread['historyId'], '2')
+        self.assertEqual(self.prefetcher.stats()['misses'], 1)
+
+    def test_keeps_generations_of_at_most_cache_size_accounts(self):
+        for pk in range(20):
+            self.prefetcher.cancel(MagicMock(pk=pk))
+
+        self.assertEqual(len(self.prefetcher.generations), 10)
+
+    def test_new_listing_cancels_pending_prefetch(self):
+        generation = self.prefetcher.cancel(self.account)
+        self.prefetcher.cancel(self.account)
+
+        self.prefetcher.prefetch(self.account, generation, ['t1'])
+
+        self.assertFalse(self.prefetcher.fetch_threads.called)
+        self.assertEqual(self.prefetcher.stats()['cancelled'], 1)
+
+    def test_respects_quota(self):
+        self.prefetcher.budget = QuotaBudget(units=10, window=60)
+
+        self.prefetcher.schedule(self.account, listing('t1', 't2'))
+
+        self.prefetcher.fetch_threads.assert_called_once_with(self.account, ['t1'])
+        self.assertEqual(self.prefetcher.stats()['throttled'], 1)
+
+    @patch('gmail_manager.prefetch.connection')
+    def test_failed_prefetch_is_counted(self, mock_connection):
+        self.prefetcher.fetch_threads.side_effect = Exception('no credentials')
+
+        self.prefetcher.schedule(self.account, listing('t1'))
+
+        self.assertEqual(self.prefetcher.stats()['failed'], 1)
+        self.assertTrue(mock_connection.close.called)
+
+    def test_miss_fetches_thread(self):
+        service = MagicMock()
+        service.users.return_value.threads.return_value.get.return_value.execute.return_value = {'id': 't9'}
+
+        self.assertEqual(self.prefetcher.get_thread(self.account, 't9', service=service), {'id': 't9'})
+
+        stats = self.prefetcher.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.0)
@@ -0,0 +1,63 @@
+import base64
+from email.header import Header
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from django.test import SimpleTestCase
+from mock import patch
+
+from .processing import MessageProcessor, html_to_text, parse_message
+
+
+def make_payload(pk='1', subject=u'Caf\xe9', html=None, text=None, charset='utf-8'):
+    message = MIMEMultipart('alternative')
+    message['Subject'] = Header(subject, 'utf-8').encode()
+    message['From'] = 'jacob@example.com'
+    message['Message-ID'] = '<%s@example.com>' % pk
+    if text is not None:
+        message.attach(MIMEText(text, 'plain', charset))
+    if html is not None:
+        message.attach(MIMEText(html, 'html', charset))
+    return {'id': pk, 'threadId': 't%s' % pk, 'raw': base64.urlsafe_b64encode(message.as_string().encode('utf-8'))}
+
+
+class ParseMessageTestCase(SimpleTestCase):
+    def test_decodes_headers(self):
+        record = parse_message(make_payload(text=u'hello'))
+
+        self.assertEqual(record['subject'], u'Caf\xe9')
+        self.assertEqual(record['message_id'], '<1@example.com>')
+        self.assertEqual(record['thread_id'], 't1')
+
+    def test_uses_part_charset(self):
+        record = parse_message(make_payload(text=u'caf\xe9', charset='iso-8859-1'))
+
+        self.assertEqual(record['body_text'], u'caf\xe9')
+
+    def test_falls_back_to_html(self):
+        record = parse_message(make_payload(html=u'<style>p {}</style><p>Hello &amp; bye</p>'))
+
+        self.assertEqual(record['body_text'], u'Hello & bye')
+        self.assertIn(u'hello & bye', record['search_text'])
+
+    def test_html_to_text_keeps_blocks_apart(self):
+        self.assertEqual(html_to_text(u'<div>one</div><div>two</div>'), u'one\ntwo')
+
+
+class MessageProcessorTestCase(SimpleTestCase):
+    def test_small_batch_runs_inline(self):
+        processor = MessageProcessor(processes=2, chunk_size=10, inline_threshold=5)
+
+        with patch('gmail_manager.processing.multiprocessing.Pool') as pool:
+            records = processor.process([make_payload(str(i), text=u'x') for i in range(3)])
+
+        self.assertFalse(pool.called)
+        self.assertEqual([record['id'] for record in records], ['0', '1', '2'])
+
+    def test_pool_keeps_order(self):
+        payloads = [make_payload(str(i), text=u'x') for i in range(7)]
+
+        with MessageProcessor(processes=2, chunk_size=2, inline_threshold=1, max_pending=2) as processor:
+            records = processor.process(iter(payloads))
+
+        self.assertEqual([record['id'] for record in records], [str(i) for i in range(7)])
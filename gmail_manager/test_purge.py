@@ -0,0 +1,116 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from mock import MagicMock, patch
+
+from .models import ChangeEvent, EmailAccount, GmailCredentialsModel, Message, MessageBody, SyncState
+from .purge import Purger
+
+
+class PurgeTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jacob', email='jacob@_', password='top_secret')
+        self.personal = self.create_account('jacob@example.com')
+        self.team = self.create_account('team@example.com')
+        self.shared = MessageBody.objects.create(content_hash='shared', content=b'shared')
+        self.own = MessageBody.objects.create(content_hash='own', content=b'own')
+
+        for i in range(5):
+            Message.objects.create(account=self.personal, message_id='p%s' % i, body=self.own)
+        Message.objects.create(account=self.personal, message_id='p-shared', body=self.shared)
+        Message.objects.create(account=self.team, message_id='t-shared', body=self.shared)
+        ChangeEvent.objects.create(account=self.personal, added='p1')
+
+        self.personal.delete()
+        EmailAccount.objects.filter(pk=self.personal.pk).update(deleted=timezone.now() - timedelta(days=60))
+
+        self.purger = Purger(batch_size=2, pause=0)
+
+    def create_account(self, address):
+        account = EmailAccount.objects.create(owner=self.user, email_address=address)
+        SyncState.objects.create(account=account)
+        return account
+
+    def test_purges_old_deleted_accounts(self):
+        with patch.object(EmailAccount, 'get_credentials', return_value=MagicMock()) as get_credentials:
+            self.assertEqual(self.purger.purge(retention=timedelta(days=30)), 1)
+
+        self.assertTrue(get_credentials.return_value.revoke.called)
+        self.assertEqual(list(EmailAccount.objects.values_list('pk', flat=True)), [self.team.pk])
+        self.assertFalse(Message.objects.filter(account_id=self.personal.pk).exists())
+        self.assertFalse(ChangeEvent.objects.exists())
+        self.assertFalse(SyncState.objects.filter(pk=self.personal.pk).exists())
+        self.assertEqual(list(MessageBody.objects.values_list('content_hash', flat=True)), ['shared'])
+
+    def test_keeps_recently_deleted_accounts(self):
+        self.purger.revoke = False
+
+        self.assertEqual(self.purger.purge(retention=timedelta(days=90)), 0)
+        self.assertEqual(Message.objects.count(), 7)
+
+    def test_revoke_failure_does_not_stop_purge(self):
+        credentials = MagicMock()
+        credentials.revoke.side_effect = Exception('invalid_token')
+
+        with patch.object(EmailAccount, 'get_credentials', return_value=credentials):
+            self.assertEqual(self.purger.purge(retention=timedelta(days=30)), 1)
+
+    def test_account_reactivated_before_claim_is_left_alone(self):
+        EmailAccount.objects.filter(pk=self.personal.pk).update(is_deleted=False)
+
+        with patch.object(EmailAccount, 'get_credentials') as get_credentials:
+            self.assertFalse(self.purger.purge_account(self.personal.pk, timezone.now() - timedelta(days=30)))
+
+        self.assertFalse(get_credentials.called)
+        self.assertEqual(Message.objects.filter(account=self.personal).count(), 6)
+
+    def test_account_reactivated_during_purge_is_kept(self):
+        self.purger.revoke = False
+
+        def reactivate():
+            EmailAccount.objects.filter(pk=self.personal.pk).update(is_deleted=False)
+        self.purger.sleep = reactivate
+
+        self.assertEqual(self.purger.purge(retention=timedelta(days=30)), 0)
+
+        # Only the first batch of messages was deleted.
+        self.assertEqual(Message.objects.filter(account=self.personal).count(), 4)
+        self.assertTrue(EmailAccount.objects.filter(pk=self.personal.pk).exists())
+        self.assertTrue(SyncState.objects.filter(pk=self.personal.pk).exists())
+        self.assertTrue(ChangeEvent.objects.filter(account=self.personal).exists())
+
+    def reconnect(self, put):
+        EmailAccount.objects.filter(pk=self.personal.pk).update(label='jacob@example.com')
+        with patch('gmail_manager.models.build_gmail_service') as build_gmail_service:
+            build_gmail_service.return_value.users.return_value.getProfile.return_value.execute.return_value = {
+                'emailAddress': 'jacob@example.com'}
+            with patch('gmail_manager.models.Storage') as storage:
+                storage.return_value.put.side_effect = put
+                return EmailAccount.create_account_from_credentials(MagicMock(), self.user)
+
+    def test_reconnect_undeletes_before_storing_credentials(self):
+        flags = []
+
+        account = self.reconnect(
+            lambda credentials: flags.append(EmailAccount.objects.get(pk=self.personal.pk).is_deleted))
+
+        self.assertEqual(account.pk, self.personal.pk)
+        self.assertEqual(flags, [False])
+
+    def test_credentials_stored_during_purge_are_kept(self):
+        old_credentials = MagicMock()
+
+        def store(credentials):
+            GmailCredentialsModel.objects.update_or_create(id=self.personal, defaults={'credentials': None})
+        self.purger.sleep = lambda: self.reconnect(store)
+
+        with patch.object(EmailAccount, 'get_credentials', return_value=old_credentials):
+            self.assertEqual(self.purger.purge(retention=timedelta(days=30)), 0)
+
+        # Only the token from before the reconnect was revoked.
+        self.assertEqual(old_credentials.revoke.call_count, 1)
+        self.assertTrue(GmailCredentialsModel.objects.filter(id=self.personal.pk).exists())
+        self.assertFalse(EmailAccount.objects.get(pk=self.personal.pk).is_deleted)
@@ -0,0 +1,75 @@
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import SimpleTestCase, RequestFactory
+from mock import patch
+
+from .models import EmailAccount, SyncState
+from .routers import PIN_COOKIE, PinningMiddleware, ReplicaRouter, unpin_this_thread, use_primary
+from .settings import gmail_settings
+
+
+@patch.object(gmail_settings, 'REPLICA_DATABASES', ('replica',))
+class ReplicaRouterTestCase(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        unpin_this_thread()
+        self.addCleanup(unpin_this_thread)
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(EmailAccount), 'replica')
+
+    def test_other_apps_are_ignored(self):
+        self.assertIsNone(self.router.db_for_read(User))
+        self.assertIsNone(self.router.db_for_write(User))
+
+    def test_sync_state_is_read_from_primary(self):
+        self.assertEqual(self.router.db_for_read(SyncState), 'default')
+
+    def test_write_outside_request_does_not_pin(self):
+        self.assertEqual(self.router.db_for_write(EmailAccount), 'default')
+        self.assertEqual(self.router.db_for_read(EmailAccount), 'replica')
+
+    def test_use_primary(self):
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(EmailAccount), 'default')
+        self.assertEqual(self.router.db_for_read(EmailAccount), 'replica')
+
+    def test_no_migrations_on_replica(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'gmail_manager'))
+        self.assertIsNone(self.router.allow_migrate('default', 'gmail_manager'))
+
+
+@patch.object(gmail_settings, 'REPLICA_DATABASES', ('replica',))
+class PinningMiddlewareTestCase(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = PinningMiddleware()
+        self.router = ReplicaRouter()
+        self.addCleanup(self.middleware.process_response, self.factory.get('/'), HttpResponse())
+
+    def test_write_sets_cookie(self):
+        request = self.factory.get('/')
+        self.middleware.process_request(request)
+        self.router.db_for_write(EmailAccount)
+        self.assertEqual(self.router.db_for_read(EmailAccount), 'default')
+
+        response = self.middleware.process_response(request, HttpResponse())
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_write_after_request_does_not_pin(self):
+        request = self.factory.get('/')
+        self.middleware.process_request(request)
+        self.middleware.process_response(request, HttpResponse())
+
+        self.router.db_for_write(EmailAccount)
+        self.assertEqual(self.router.db_for_read(EmailAccount), 'replica')
+
+    def test_cookie_pins_next_request(self):
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = 'y'
+        self.middleware.process_request(request)
+
+        self.assertEqual(self.router.db_for_read(EmailAccount), 'default')
+        response = self.middleware.process_response(request, HttpResponse())
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.router.db_for_read(EmailAccount), 'replica')
@@ -1,9 +1,11 @@
 from django.conf.urls import patterns, url
 
-from .views import SetupEmailAuthView, OAuth2CallbackView
+from .views import SetupEmailAuthView, OAuth2CallbackView, ExportMailboxView, SyncHealthView
 
 urlpatterns = patterns(
     '',
     url(r'^setup/$', SetupEmailAuthView.as_view(), name='gmail_setup'),
     url(r'^callback/$', OAuth2CallbackView.as_view(), name='gmail_callback'),
+    url(r'^export/(?P<pk>\d+)/$', ExportMailboxView.as_view(), name='gmail_export'),
+    url(r'^health/$', SyncHealthView.as_view(), name='gmail_health'),
 )
@@ -1,6 +1,12 @@
-import httplib2
+import json
 
-from googleapiclient.discovery import build
+from django.db import connections
+
+# Gmail quota units of the requests this app makes, see ``SyncState.add_quota_usage``.
+MESSAGE_GET_UNITS = 5
+MESSAGE_LIST_UNITS = 5
+THREAD_GET_UNITS = 10
+THREAD_LIST_UNITS = 10
 
 
 def build_gmail_service(credentials):
@@ -13,5 +19,58 @@ def build_gmail_service(credentials):
     Returns:
       Gmail service object.
     """
+    # Imported here, the discovery client is heavy and most processes never talk to Gmail.
+    import httplib2
+    from googleapiclient.discovery import build
+
     http = credentials.authorize(httplib2.Http())
     return build('gmail', 'v1', http=http)
+
+
+def estimate_count(queryset):
+    """
+    Estimate the number of rows of a queryset.
+
+    COUNT(*) over a large table is a sequential scan in PostgreSQL, so the
+    planner's estimate is used instead: the table statistics for an
+    unfiltered queryset, otherwise the row estimate of the query plan. Other
+    databases fall back to a real count.
+
+    Args:
+      queryset (instance): QuerySet to count.
+
+    Returns:
+      Estimated number of rows.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            if row is not None and row[0] > 0:
+                return int(row[0])
+            return queryset.count()
+
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+        plan = cursor.fetchone()[0]
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def chunked(iterable, size):
+    """
+    Yield lists of at most ``size`` items from iterable, consuming it lazily.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -1,20 +1,41 @@
+import os
+from datetime import timedelta
+
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseRedirect, HttpResponseBadRequest
+from django.db.models import Q
+from django.http import HttpResponseRedirect, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django.views.generic import View
-from oauth2client.client import OAuth2WebServerFlow
 from oauth2client.xsrfutil import generate_token, validate_token
 
 from .models import EmailAccount
 from .settings import gmail_settings
+from .utils import estimate_count
+
+FLOW = None
+
+
+def get_flow():
+    """
+    Get the OAuth2 flow, it's constructed on first use instead of at import time.
+
+    :return: OAuth2WebServerFlow instance.
+    """
+    global FLOW
+    if FLOW is None:
+        from oauth2client.client import OAuth2WebServerFlow
 
-FLOW = OAuth2WebServerFlow(
-    client_id=gmail_settings.CLIENT_ID,
-    client_secret=gmail_settings.CLIENT_SECRET,
-    redirect_uri=gmail_settings.CALLBACK_URL,
-    scope='https://mail.google.com/',
-    approval_prompt='force',
-)
+        FLOW = OAuth2WebServerFlow(
+            client_id=gmail_settings.CLIENT_ID,
+            client_secret=gmail_settings.CLIENT_SECRET,
+            redirect_uri=gmail_settings.CALLBACK_URL,
+            scope='https://mail.google.com/',
+            approval_prompt='force',
+        )
+    return FLOW
 
 
 class SetupEmailAuthView(View):
@@ -42,8 +63,9 @@ class SetupEmailAuthView(View):
 
         """
         state = generate_token(settings.SECRET_KEY, request.user.pk)
-        FLOW.params['state'] = state
-        authorize_url = FLOW.step1_get_authorize_url()
+        flow = get_flow()
+        flow.params['state'] = state
+        authorize_url = flow.step1_get_authorize_url()
 
         return HttpResponseRedirect(authorize_url)
 
@@ -100,4 +122,135 @@ class OAuth2CallbackView(View):
 
         :return: credentials instance from Google.
         """
-        return FLOW.step2_exchange(code=code)
+        return get_flow().step2_exchange(code=code)
+
+
+class ExportMailboxView(View):
+    """
+    View to download all messages of an EmailAccount.
+
+    View needs an authenticated user, who owns the account.
+
+    The archive is streamed while messages are fetched from Google, use
+    ``?format=eml`` for a zip of eml files instead of a mbox file.
+    """
+
+    @classmethod
+    def as_view(cls, *args, **kwargs):
+        return login_required(super(ExportMailboxView, cls).as_view(*args, **kwargs))
+
+    def get(self, request, pk):
+        """
+        Get request will stream the archive of the account.
+
+        :param instance request: Request object
+        :param str pk: primary key of the EmailAccount
+
+        :return: StreamingHttpResponse with the archive
+        """
+        # Imported here, the export pulls in zipfile, email and the thread pool.
+        from .export import CONTENT_TYPES, EXTENSIONS, FORMATS, MBOX, stream_account
+
+        account = get_object_or_404(EmailAccount, pk=pk, owner=request.user, is_deleted=False)
+
+        format = request.GET.get('format', MBOX)
+        if format not in FORMATS:
+            return HttpResponseBadRequest()
+
+        # Check before streaming, an error inside the stream only shows as a truncated download.
+        credentials = account.get_credentials() if account.is_authorized else None
+        if credentials is None or credentials.invalid:
+            return HttpResponseBadRequest('Account is not authorized, set it up again.')
+
+        response = StreamingHttpResponse(stream_account(account, format), content_type=CONTENT_TYPES[format])
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (account.email_address, EXTENSIONS[format])
+        return response
+
+
+class SyncHealthView(View):
+    """
+    JSON overview of the sync health of EmailAccounts.
+
+    View needs a staff user.
+
+    Accounts are ordered by id and paginated on it: pass the ``next`` value of
+    a response as ``after`` to get the next page. Use ``status`` to only list
+    accounts that are ``lagging``, have sync ``errors`` or are ``unauthorized``.
+
+    The response also has the thread prefetch statistics, these are counted
+    per process so they only cover the process (``pid``) that answered.
+    """
+    statuses = ('lagging', 'errors', 'unauthorized')
+
+    @classmethod
+    def as_view(cls, *args, **kwargs):
+        return staff_member_required(super(SyncHealthView, cls).as_view(*args, **kwargs))
+
+    def get_queryset(self, status):
+        queryset = EmailAccount.objects.filter(is_deleted=False)
+        if status == 'lagging':
+            threshold = timezone.now() - timedelta(seconds=gmail_settings.HEALTH_LAG_SECONDS)
+            queryset = queryset.filter(
+                Q(sync_state__last_sync_finished__lt=threshold) | Q(sync_state__last_sync_finished__isnull=True))
+        elif status == 'errors':
+            queryset = queryset.filter(sync_state__error_count__gt=0)
+        elif status == 'unauthorized':
+            queryset = queryset.filter(is_authorized=False)
+        return queryset
+
+    def get(self, request):
+        """
+        Get request will return a page of accounts with their sync health.
+
+        :param instance request: Request object
+
+        :return: JsonResponse with the accounts, the cursor of the next page, an estimated total and
+                 the prefetch statistics
+        """
+        from .prefetch import get_prefetcher
+
+        status = request.GET.get('status')
+        if status is not None and status not in self.statuses:
+            return HttpResponseBadRequest()
+        try:
+            after = int(request.GET.get('after', 0))
+            limit = max(min(int(request.GET.get('limit', gmail_settings.HEALTH_PAGE_SIZE)), 1000), 1)
+        except ValueError:
+            return HttpResponseBadRequest()
+
+        queryset = self.get_queryset(status)
+        rows = list(queryset.filter(pk__gt=after).order_by('pk').values(
+            'id',
+            'email_address',
+            'owner_id',
+            'is_authorized',
+            'sync_state__last_sync_finished',
+            'sync_state__error_count',
+            'sync_state__last_error',
+            'sync_state__quota_used',
+            'sync_state__lease_holder',
+        )[:limit + 1])
+
+        now = timezone.now()
+        accounts = []
+        for row in rows[:limit]:
+            last_sync = row['sync_state__last_sync_finished']
+            accounts.append({
+                'id': row['id'],
+                'email_address': row['email_address'],
+                'owner': row['owner_id'],
+                'is_authorized': row['is_authorized'],
+                'last_sync': last_sync.isoformat() if last_sync else None,
+                'sync_lag': (now - last_sync).total_seconds() if last_sync else None,
+                'error_count': row['sync_state__error_count'],
+                'last_error': row['sync_state__last_error'],
+                'quota_used': row['sync_state__quota_used'],
+                'lease_holder': row['sync_state__lease_holder'],
+            })
+
+        return JsonResponse({
+            'accounts': accounts,
+            'next': accounts[-1]['id'] if len(rows) > limit else None,
+            'estimated_total': estimate_count(queryset),
+            'prefetch': dict(get_prefetcher().stats(), pid=os.getpid()),
+        })